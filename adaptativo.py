@@ -0,0 +1,208 @@
+import atexit
+import csv
+import os
+import random
+from array import array
+from math import exp, inf, log
+from multiprocessing import Pool
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from shared import *
+import sequencial
+import paralelo
+
+try:
+    import numpy as np
+    import vetorizado
+except ImportError:
+    np = None
+
+table_file = "tabela_completa.csv"
+probe_sizes = [16, 32, 64, 128]
+
+# backend -> mat_exp runner, the pool backends receive the worker count
+pooled = {"Paralelo"}
+runners = {
+    "Sequencial": lambda a, b, workers: sequencial.mat_exp(a, b),
+    "Paralelo": lambda a, b, workers: paralelo.mat_exp(a, b, get_pool(workers)),
+    "Vetorizado": lambda a, b, workers: vetorizado.mat_exp(a, b),
+}
+
+_pools: Dict[int, Pool] = {}
+
+def get_pool(workers: int) -> Pool:
+    if workers not in _pools:
+        _pools[workers] = Pool(processes=workers)
+    return _pools[workers]
+
+@atexit.register
+def close_pools():
+    for pool in _pools.values():
+        pool.terminate()
+    _pools.clear()
+
+def products(b: int) -> int:
+    return max(len(exp_plan(b).steps), 1)
+
+def mean_products_by_n() -> Dict[int, float]:
+    totals: Dict[int, List[int]] = {}
+    for i in range(testcases):
+        try:
+            n, b = read_header(i)
+        except FileNotFoundError:
+            break
+        # the benchmark tables were measured with the plain binary loop
+        totals.setdefault(n, []).append(binary_products(b))
+    return {n: sum(counts) / len(counts) for n, counts in totals.items()}
+
+def interpolate(points: List[Tuple[int, float]], n: int, power: int) -> float:
+    # log-log interpolation, extrapolated with the slope of the closest segment;
+    # a single point is scaled by n^power
+    if len(points) == 1:
+        n0, t0 = points[0]
+        return t0 * (n / n0) ** power
+    for (n0, t0), (n1, t1) in zip(points, points[1:]):
+        if n <= n1:
+            break
+    slope = (log(t1) - log(t0)) / (log(n1) - log(n0))
+    return exp(log(t0) + max(slope, 0.0) * (log(n) - log(n0)))
+
+class CostModel:
+    # per (backend, workers): measured seconds per product at a few N, plus what a
+    # call costs before its first product (conversions, reduction, starting the pool)
+    def __init__(self):
+        self.points: Dict[Tuple[str, int], List[Tuple[int, float]]] = {}
+        self.overhead: Dict[Tuple[str, int], List[Tuple[int, float]]] = {}
+        self.spawn = 0.0
+
+    def add(self, backend: str, workers: int, n: int, seconds_per_product: float):
+        points = self.points.setdefault((backend, workers), [])
+        points.append((n, max(seconds_per_product, 1e-9)))
+        points.sort()
+
+    def add_overhead(self, backend: str, workers: int, n: int, seconds: float):
+        points = self.overhead.setdefault((backend, workers), [])
+        points.append((n, max(seconds, 1e-9)))
+        points.sort()
+
+    def per_product(self, backend: str, workers: int, n: int) -> float:
+        return interpolate(self.points[(backend, workers)], n, 3)
+
+    def per_call(self, backend: str, workers: int, n: int) -> float:
+        # the per-call work does not depend on the worker count, so table rows borrow
+        # the probed one; a pool that is not running yet adds spawn seconds per worker
+        points = self.overhead.get((backend, workers))
+        if points is None:
+            points = next((p for (name, _), p in self.overhead.items() if name == backend), None)
+        seconds = interpolate(points, n, 2) if points else 0.0
+        if backend in pooled and workers not in _pools:
+            seconds += self.spawn * workers
+        return seconds
+
+    def predict(self, backend: str, workers: int, n: int, b: int) -> float:
+        return self.per_call(backend, workers, n) + products(b) * self.per_product(backend, workers, n)
+
+    def choose(self, n: int, b: int) -> Tuple[str, int]:
+        # returns backend and worker count; paralelo tiles the rows itself (auto_tile)
+        # MPI rows calibrate the model but need mpiexec, and the table may come from a bigger machine
+        cores = os.cpu_count() or 1
+        candidates = [key for key in self.points if key[0] in runners and key[1] <= cores]
+        if np is None:
+            candidates = [key for key in candidates if key[0] != "Vetorizado"]
+        backend, workers = min(candidates, key=lambda key: self.predict(key[0], key[1], n, b))
+        return backend, workers
+
+    @classmethod
+    def from_table(cls, path: str = table_file) -> "CostModel":
+        model = cls()
+        mean_products = mean_products_by_n()
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                n = int(row["N"])
+                if n in mean_products:
+                    model.add(row["Algoritmo"], int(row["Cores"]), n, float(row["duration"]) / mean_products[n])
+        return model
+
+    @staticmethod
+    def probe_matrix(n: int) -> Matrix:
+        # dense full-size entries: the packed kernel is much faster on an identity
+        rng = random.Random(n)
+        return Matrix(n, n, array('q', [rng.randrange(mod) for _ in range(n * n)]))
+
+    def probe_overhead(self, backend: str, workers: int, n: int):
+        # b = 1 runs no product, so the call is only its fixed part
+        a = self.probe_matrix(n)
+        best = inf
+        for _ in range(3):
+            start = perf_counter()
+            runners[backend](a, 1, workers)
+            best = min(best, perf_counter() - start)
+        self.add_overhead(backend, workers, n, best)
+
+    def probe(self, cores: Optional[int] = None) -> "CostModel":
+        # a few single products per backend, enough to place the crossovers on this machine
+        cores = cores or os.cpu_count() or 1
+        if np is not None:
+            for n in probe_sizes:
+                a = vetorizado.to_array(self.probe_matrix(n))
+                start = perf_counter()
+                vetorizado.mod_matmul(a, a)
+                self.add("Vetorizado", 1, n, perf_counter() - start)
+                self.probe_overhead("Vetorizado", 1, n)
+        for n in probe_sizes:
+            a = self.probe_matrix(n)
+            start = perf_counter()
+            sequencial.mat_mul(a, a)
+            self.add("Sequencial", 1, n, perf_counter() - start)
+            self.probe_overhead("Sequencial", 1, n)
+        if cores > 1:
+            started = cores not in _pools
+            start = perf_counter()
+            pool = get_pool(cores)
+            # Pool() returns before its workers are up, one task each waits for them
+            pool.map(abs, range(cores), chunksize=1)
+            if started:
+                self.spawn = (perf_counter() - start) / cores
+            for n in probe_sizes[:3]:
+                a = self.probe_matrix(n)
+                start = perf_counter()
+                paralelo.mat_mul_parallel(a, a, pool)
+                self.add("Paralelo", cores, n, perf_counter() - start)
+                self.probe_overhead("Paralelo", cores, n)
+            if started:
+                # not kept: the first call whose b pays for the spawn starts it again
+                _pools.pop(cores).terminate()
+        return self
+
+    def calibrate(self, table: "CostModel") -> "CostModel":
+        # the table's seconds come from older kernels or another machine, so only the
+        # worker counts the probes did not cover are taken from it, as the table's
+        # speedup over Sequencial applied to the live Sequencial probe
+        reference = ("Sequencial", 1)
+        if reference not in self.points or reference not in table.points:
+            return self
+        for (backend, workers), points in table.points.items():
+            if (backend, workers) in self.points or backend not in runners:
+                continue
+            for n, t in points:
+                self.add(backend, workers, n, self.per_product(*reference, n) * t / table.per_product(*reference, n))
+        return self
+
+_model: Optional[CostModel] = None
+
+def get_model() -> CostModel:
+    global _model
+    if _model is None:
+        _model = CostModel().probe()
+        if os.path.exists(table_file):
+            _model.calibrate(CostModel.from_table())
+    return _model
+
+def mat_exp(a: Matrix, b: int) -> Matrix:
+    backend, workers = get_model().choose(len(a), b)
+    return runners[backend](a, b, workers)
+
+if __name__ == "__main__":
+    import benchmark
+    benchmark.main(["--backend", "adaptativo"] + sys.argv[1:])
@@ -0,0 +1,184 @@
+import json
+import os
+import re
+
+import pandas as pd
+
+from shared import binary_test, output_folder, read_header, test_ids, test_path
+
+# Camada comum do stats.py e do overhead.py: índice N/b dos testes, descoberta dos
+# resultados em output/, cache do DataFrame e controle do que precisa ser regerado.
+# Tudo que vai para o cache é chaveado pelo mtime e tamanho dos arquivos de entrada.
+pasta_cache = ".cache_analise"
+arquivo_indice = os.path.join(pasta_cache, "testes.json")
+arquivo_manifesto = os.path.join(pasta_cache, "manifesto.json")
+
+padrao_resultado = re.compile(r"^(?P<base>[a-z]+)(?:_(?P<variante>[a-z0-9]*[a-z]))?(?P<cores>\d*)\.csv$")
+padrao_hibrido = re.compile(r"^hibrido_(\d+)x(\d+)x(\d+)_([a-z]+)\.csv$")
+
+_graficos = None
+
+def graficos():
+    # matplotlib e seaborn só são importados quando algum gráfico vai mesmo ser gerado
+    global _graficos
+    if _graficos is None:
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        sns.set_theme(style="whitegrid")
+        _graficos = (plt, sns)
+    return _graficos
+
+def assinatura(paths):
+    return sorted([p, os.stat(p).st_mtime_ns, os.stat(p).st_size] for p in set(paths) if os.path.exists(p))
+
+def ler_json(path, padrao):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return padrao
+
+def salvar_json(path, dados):
+    os.makedirs(pasta_cache, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dados, f)
+
+def indice_testes():
+    # {teste: (N, b)} lendo só o cabeçalho, e só dos testes cujo arquivo mudou
+    indice = ler_json(arquivo_indice, {})
+    resultado = {}
+    mudou = False
+    for i in test_ids():
+        path = binary_test(i) or test_path(i)
+        chave = assinatura([path])
+        entrada = indice.get(str(i))
+        if entrada is None or entrada["assinatura"] != chave:
+            n, b = read_header(i)
+            entrada = {"assinatura": chave, "n": n, "b": b}
+            indice[str(i)] = entrada
+            mudou = True
+        resultado[i] = (entrada["n"], entrada["b"])
+    if mudou:
+        salvar_json(arquivo_indice, indice)
+    return resultado
+
+def descobrir_resultados():
+    # {rótulo: (arquivo, algoritmo, cores)} para todo CSV de output/ no formato de uma
+    # coluna "duration" por teste; _phases, _bytes, bench_ e batch têm outro formato
+    encontrados = {}
+    if not os.path.isdir(output_folder):
+        return encontrados
+    for filename in sorted(os.listdir(output_folder)):
+        path = os.path.join(output_folder, filename)
+        with open(path) as f:
+            if f.readline().strip() != "duration":
+                continue
+        hibrido = padrao_hibrido.match(filename)
+        resultado = padrao_resultado.match(filename)
+        if hibrido:
+            nos, ranks, workers, tipo = hibrido.groups()
+            algoritmo = f"Hibrido-{tipo}"
+            cores = int(nos) * int(ranks) * int(workers)
+            rotulo = f"{algoritmo} ({nos}x{ranks}x{workers})"
+        elif resultado:
+            base, variante, cores = resultado.group("base", "variante", "cores")
+            algoritmo = base.capitalize() + (f"-{variante}" if variante else "")
+            cores = int(cores) if cores else 1
+            unidade = "Nós" if base == "distribuido" else "Cores"
+            rotulo = f"{algoritmo} ({cores} {unidade})" if resultado.group("cores") else algoritmo
+        else:
+            continue
+        encontrados[rotulo] = (path, algoritmo, cores)
+    return encontrados
+
+def carregar_cache(nome, entradas, construir):
+    # devolve o DataFrame salvo se nenhuma entrada mudou, senão constrói e salva de novo
+    dados = os.path.join(pasta_cache, f"{nome}.pkl")
+    chave = os.path.join(pasta_cache, f"{nome}.json")
+    atual = assinatura(entradas)
+    if os.path.exists(dados) and ler_json(chave, None) == atual:
+        return pd.read_pickle(dados)
+    df = construir()
+    if df is not None:
+        os.makedirs(pasta_cache, exist_ok=True)
+        df.to_pickle(dados)
+        salvar_json(chave, atual)
+    return df
+
+def arquivos_testes():
+    return [p for i in test_ids() for p in (test_path(i), test_path(i, "bin")) if os.path.exists(p)]
+
+def carregar_dados():
+    resultados = descobrir_resultados()
+
+    def construir():
+        tamanhos = [n for _, (n, _) in sorted(indice_testes().items())]
+        data_frames = []
+        for rotulo, (path, algoritmo, cores) in resultados.items():
+            df = pd.read_csv(path)
+            limit = min(len(df), len(tamanhos))
+            df = df.iloc[:limit]
+            df['N'] = tamanhos[:limit]
+            df['Algoritmo'] = algoritmo
+            df['Cores'] = cores
+            df['NomeCompleto'] = rotulo
+            data_frames.append(df)
+        if not data_frames: return None
+        return pd.concat(data_frames)
+
+    return carregar_cache("dados", [path for path, _, _ in resultados.values()] + arquivos_testes(), construir)
+
+def arquivos_fases():
+    if not os.path.isdir(output_folder):
+        return []
+    return [os.path.join(output_folder, f) for f in sorted(os.listdir(output_folder)) if f.endswith("_phases.csv")]
+
+def carregar_fases():
+    # output/*_phases.csv: uma linha por produto (e por rank no distribuído), com os
+    # segundos de cada fase e os bytes transferidos
+    arquivos = arquivos_fases()
+
+    def construir():
+        indice = indice_testes()
+        data_frames = []
+        for path in arquivos:
+            df = pd.read_csv(path)
+            if df.empty:
+                continue
+            df['N'] = df['test'].map(lambda i: indice[i][0])
+            df['NomeCompleto'] = os.path.basename(path)[:-len("_phases.csv")]
+            for coluna in ('rank', 'bytes'):
+                if coluna not in df.columns:
+                    df[coluna] = 0
+            data_frames.append(df)
+        if not data_frames: return None
+        return pd.concat(data_frames)
+
+    return carregar_cache("fases", arquivos + arquivos_testes(), construir)
+
+def resumir_fases(df):
+    # soma os produtos de cada teste, tira a média entre os ranks e depois entre os testes de mesmo N
+    fases = [c for c in df.columns if c not in ('test', 'iteration', 'rank', 'bytes', 'N', 'NomeCompleto')]
+    por_teste = df.groupby(['NomeCompleto', 'N', 'test', 'rank'])[fases + ['bytes']].sum(min_count=1).reset_index()
+    por_teste = por_teste.groupby(['NomeCompleto', 'N', 'test'])[fases + ['bytes']].mean().reset_index()
+    return por_teste.groupby(['NomeCompleto', 'N'])[fases + ['bytes']].mean().reset_index(), fases
+
+def entradas(df, *extras):
+    # arquivos de resultado por trás das linhas de df (pela coluna NomeCompleto), mais os
+    # testes e o sequencial, de onde vêm N e o tempo de referência das métricas
+    resultados = descobrir_resultados()
+    arquivos = [resultados[r][0] for r in df['NomeCompleto'].unique() if r in resultados]
+    if "Sequencial" in resultados:
+        arquivos.append(resultados["Sequencial"][0])
+    return arquivos + arquivos_testes() + list(extras)
+
+def precisa_gerar(saida, arquivos):
+    # refaz a saída quando ela não existe ou quando alguma entrada mudou desde a última vez
+    if not os.path.exists(saida):
+        return True
+    return ler_json(arquivo_manifesto, {}).get(saida) != assinatura(arquivos)
+
+def marcar_gerado(saida, arquivos):
+    manifesto = ler_json(arquivo_manifesto, {})
+    manifesto[saida] = assinatura(arquivos)
+    salvar_json(arquivo_manifesto, manifesto)
@@ -0,0 +1,260 @@
+import argparse
+import csv
+import importlib
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+from math import exp, inf, lgamma, log, sqrt
+from statistics import mean, stdev, variance
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import shared
+from shared import *
+
+# python benchmark.py --backend pool --workers 4 --sizes 64,128 --warmup 1 --repetitions 5
+# mpiexec -n 4 python benchmark.py --backend mpi-buffer
+# python benchmark.py --backend pool --workers 4 --baseline output/bench_pool4.csv
+# the first five run in this process alone, so their rows and file names record 1 worker
+serial_backends = ["sequencial", "vetorizado", "strassen", "caracteristico", "adaptativo"]
+local_backends = serial_backends + ["pool", "threads", "shm", "resident", "pool-strassen"]
+mpi_backends = ["mpi", "mpi-buffer", "mpi-resident", "mpi-summa", "mpi-strassen", "mpi-pipelined", "mpi-hybrid"]
+sample_header = ["test", "n", "b", "backend", "workers", "repetition", "duration"]
+metadata_header = ["host", "machine", "cpus", "python", "kernel", "git", "date"]
+
+def git_revision() -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{rev}-dirty" if dirty else rev
+
+def run_metadata() -> List:
+    return [platform.node(), platform.machine(), os.cpu_count(), platform.python_version(),
+            shared.kernel, git_revision(), datetime.now(timezone.utc).isoformat(timespec="seconds")]
+
+def local_runner(backend: str, workers: int) -> Tuple[Callable, Callable]:
+    # (mat_exp(a, b), close) for the backends that run inside this process
+    if backend in ("strassen", "pool-strassen"):
+        importlib.import_module("strassen").ensure_cutoff()
+    if backend in serial_backends:
+        return importlib.import_module(backend).mat_exp, lambda: None
+
+    import paralelo
+    if backend == "shm":
+        pool = paralelo.SharedPool(workers)
+        return lambda a, b: paralelo.mat_exp_shm(a, b, pool), pool.close
+    if backend == "resident":
+        pool = paralelo.ResidentPool(workers)
+        return lambda a, b: paralelo.mat_exp_resident(a, b, pool), pool.close
+    pool = paralelo.ThreadPool(workers) if backend == "threads" else paralelo.Pool(workers)
+    if backend == "pool-strassen":
+        return lambda a, b: paralelo.mat_exp_strassen(a, b, pool), pool.terminate
+    return lambda a, b: paralelo.mat_exp(a, b, pool), pool.terminate
+
+def mpi_runner(backend: str, workers: int) -> Tuple[Callable, Callable]:
+    # every rank calls run(a, b, n), a is only read on rank 0
+    import distribuido
+    mode = backend[len("mpi-"):] if backend != "mpi" else "pickle"
+    if mode == "hybrid":
+        distribuido.start_local_pool(workers)
+    if mode == "strassen":
+        distribuido.share_strassen_cutoff()
+    runs = {
+        "pickle": lambda a, b, n: distribuido.mat_exp_mpi(a, b),
+        "hybrid": lambda a, b, n: distribuido.mat_exp_mpi(a, b),
+        "buffer": lambda a, b, n: distribuido.mat_exp_mpi_buffer(a, b, n)[0],
+        "resident": lambda a, b, n: distribuido.mat_exp_mpi_resident(a, b, n)[0],
+        "summa": lambda a, b, n: distribuido.mat_exp_mpi_summa(a, b, n)[0],
+        "strassen": lambda a, b, n: distribuido.mat_exp_mpi_strassen(a, b, n),
+        "pipelined": lambda a, b, n: distribuido.mat_exp_mpi_pipelined(a, b, n)[0],
+    }
+    close = lambda: distribuido.local_pool.terminate() if distribuido.local_pool is not None else None
+    return runs[mode], close
+
+def parse_ids(text: str) -> List[int]:
+    # "0,3,10-14"
+    ids = []
+    for part in text.split(","):
+        start, _, end = part.partition("-")
+        ids.extend(range(int(start), int(end or start) + 1))
+    return ids
+
+def select_tests(args) -> List[Tuple[int, int, int]]:
+    selected = []
+    wanted = set(parse_ids(args.tests)) if args.tests else None
+    sizes = {int(n) for n in args.sizes.split(",")} if args.sizes else None
+    for i in test_ids():
+        n, b = read_header(i)
+        if wanted is not None and i not in wanted:
+            continue
+        if sizes is not None and n not in sizes:
+            continue
+        if n < args.min_n or (args.max_n and n > args.max_n):
+            continue
+        selected.append((i, n, b))
+    return selected
+
+def recorded_workers(args) -> int:
+    return 1 if args.backend in serial_backends else args.workers
+
+def benchmark(args) -> Optional[List[List]]:
+    mpi = args.backend in mpi_backends
+    comm = None
+    workers = recorded_workers(args)
+    if mpi:
+        import distribuido
+        comm = distribuido.comm
+        root = distribuido.rank == 0
+        run, close = mpi_runner(args.backend, workers)
+        workers = distribuido.size if args.backend != "mpi-hybrid" else distribuido.size * workers
+        tests = comm.bcast(select_tests(args) if root else None, root=0)
+    else:
+        root = True
+        exp_local, close = local_runner(args.backend, workers)
+        run = lambda a, b, n: exp_local(a, b)
+        tests = select_tests(args)
+
+    metadata = run_metadata() if root else None
+    rows = []
+    try:
+        for i, n, b in tests:
+            mat = read_input(i)[2] if root else None
+            samples = []
+            for repetition in range(args.warmup + args.repetitions):
+                if comm is not None:
+                    comm.Barrier()
+                start = perf_counter()
+                run(mat, b, n)
+                if comm is not None:
+                    comm.Barrier()
+                duration = perf_counter() - start
+                if repetition >= args.warmup and root:
+                    samples.append(duration)
+                    rows.append([i, n, b, args.backend, workers, repetition - args.warmup, duration] + metadata)
+            if root:
+                spread = stdev(samples) if len(samples) > 1 else 0.0
+                print(f"Test {i+1:02d} | N={n} B={b} | {mean(samples):.4f}s ± {spread:.4f}s ({len(samples)} runs)")
+    finally:
+        close()
+    return rows if root else None
+
+def read_samples(path: str) -> Dict[Tuple[int, int, int], List[float]]:
+    samples: Dict[Tuple[int, int, int], List[float]] = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            samples.setdefault((int(row["test"]), int(row["n"]), int(row["b"])), []).append(float(row["duration"]))
+    return samples
+
+def beta_fraction(a: float, b: float, x: float) -> float:
+    # continued fraction of the incomplete beta function, modified Lentz
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= c * d
+        if abs(c * d - 1.0) < 1e-12:
+            break
+    return h
+
+def incomplete_beta(a: float, b: float, x: float) -> float:
+    # regularized I_x(a, b)
+    if x <= 0.0 or x >= 1.0:
+        return max(0.0, min(1.0, x))
+    front = exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * log(x) + b * log(1.0 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * beta_fraction(a, b, x) / a
+    return 1.0 - front * beta_fraction(b, a, 1.0 - x) / b
+
+def welch_test(current: List[float], baseline: List[float]) -> Tuple[float, float]:
+    # t statistic and one-sided p-value of "current is slower than baseline"
+    var_current = variance(current) / len(current)
+    var_baseline = variance(baseline) / len(baseline)
+    diff = mean(current) - mean(baseline)
+    if var_current + var_baseline == 0:
+        return (inf, 0.0) if diff > 0 else (-inf, 1.0)
+    t = diff / sqrt(var_current + var_baseline)
+    df = (var_current + var_baseline) ** 2 / (var_current ** 2 / (len(current) - 1) + var_baseline ** 2 / (len(baseline) - 1))
+    tail = 0.5 * incomplete_beta(df / 2, 0.5, df / (df + t * t))
+    return t, tail if t > 0 else 1.0 - tail
+
+def compare(current: Dict[Tuple[int, int, int], List[float]], baseline: Dict[Tuple[int, int, int], List[float]],
+            alpha: float, threshold: float) -> int:
+    # a test regresses when it is slower by more than threshold and the difference is
+    # significant at alpha; returns how many did
+    regressions = 0
+    for key in sorted(current.keys() & baseline.keys()):
+        i, n, b = key
+        now, before = current[key], baseline[key]
+        if len(now) < 2 or len(before) < 2:
+            print(f"Test {i+1:02d} | N={n} | needs 2+ samples on both sides, skipped")
+            continue
+        t, p = welch_test(now, before)
+        slowdown = mean(now) / mean(before) - 1
+        flagged = p < alpha and slowdown > threshold
+        regressions += flagged
+        status = "REGRESSION" if flagged else "ok"
+        print(f"Test {i+1:02d} | N={n} | {mean(before):.4f}s -> {mean(now):.4f}s ({slowdown:+.1%}) | t={t:.2f} p={p:.4f} | {status}")
+    print(f"--- {regressions} regression(s) ---")
+    return regressions
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark mat_exp backends over the test cases in tests/")
+    parser.add_argument("--backend", choices=local_backends + mpi_backends, default="sequencial")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="pool size; with MPI the rank count comes from mpiexec and this is the pool per rank of mpi-hybrid")
+    parser.add_argument("--kernel", choices=["python", "numpy"], default=shared.kernel, help="kernel behind the list backends")
+    parser.add_argument("--verify", type=int, default=shared.verify_rounds, metavar="ROUNDS",
+                        help="Freivalds rounds run on every product, 0 skips the check")
+    parser.add_argument("--tests", help="test ids, e.g. 0,3,10-14")
+    parser.add_argument("--sizes", help="only these N, e.g. 64,128")
+    parser.add_argument("--min-n", type=int, default=0)
+    parser.add_argument("--max-n", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before the samples")
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--output", help="csv name inside output/, default bench_<backend><workers>")
+    parser.add_argument("--baseline", help="csv of an earlier run to check for regressions against")
+    parser.add_argument("--compare", help="csv to check against --baseline without running anything")
+    parser.add_argument("--alpha", type=float, default=0.01, help="significance level of the Welch test")
+    parser.add_argument("--threshold", type=float, default=0.05, help="smallest relative slowdown reported")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None):
+    # also the __main__ of the serial backend modules, e.g. python vetorizado.py --sizes 64
+    args = parse_args(argv)
+    shared.kernel = args.kernel
+    shared.verify_rounds = args.verify
+
+    if args.compare:
+        if not args.baseline:
+            sys.exit("--compare needs --baseline")
+        sys.exit(1 if compare(read_samples(args.compare), read_samples(args.baseline), args.alpha, args.threshold) else 0)
+
+    rows = benchmark(args)
+    if rows is None:
+        sys.exit()
+    name = args.output or f"bench_{args.backend}{rows[0][4] if rows else recorded_workers(args)}"
+    write_rows(name, sample_header + metadata_header, rows)
+    print(f"--- {len(rows)} samples -> {output_folder}/{name}.csv ---")
+
+    if args.baseline:
+        current = {}
+        for row in rows:
+            current.setdefault((row[0], row[1], row[2]), []).append(row[6])
+        sys.exit(1 if compare(current, read_samples(args.baseline), args.alpha, args.threshold) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+from functools import lru_cache
+from math import isqrt
+from time import perf_counter
+from typing import Tuple
+
+import numpy as np
+
+import shared
+import vetorizado
+from shared import *
+from vetorizado import mod_matmul, to_array, to_matrix, mat_exp_array
+
+def hessenberg(a: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # similarity transform to upper Hessenberg form over GF(p), a must be reduced
+    h = a.copy()
+    n = h.shape[0]
+    for k in range(n - 2):
+        nonzero = np.nonzero(h[k + 1:, k])[0]
+        if nonzero.size == 0:
+            continue
+        pivot = k + 1 + nonzero[0]
+        if pivot != k + 1:
+            h[[pivot, k + 1]] = h[[k + 1, pivot]]
+            h[:, [pivot, k + 1]] = h[:, [k + 1, pivot]]
+        inv = pow(int(h[k + 1, k]), mod_val - 2, mod_val)
+        f = h[k + 2:, k] * inv % mod_val
+        if not f.any():
+            continue
+        # rows: r_i -= f_i * r_(k+1), then columns: c_(k+1) += sum f_i * c_i
+        h[k + 2:] = (h[k + 2:] - f[:, None] * h[k + 1] % mod_val) % mod_val
+        h[:, k + 1] = (h[:, k + 1] + mod_matmul(h[:, k + 2:], f[:, None], mod_val)[:, 0]) % mod_val
+    return h
+
+def char_poly(a: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # coefficients, lowest degree first, of det(xI - a) mod p; the result is monic of degree n
+    h = hessenberg(a, mod_val)
+    n = h.shape[0]
+    polys = np.zeros((n + 1, n + 1), dtype=np.int64)
+    polys[0, 0] = 1
+    for m in range(1, n + 1):
+        # p_m = (x - h[m-1][m-1]) p_(m-1) - sum_i h[i-1][m-1] * prod(subdiagonal) * p_(i-1)
+        weights = np.zeros(m, dtype=np.int64)
+        weights[m - 1] = h[m - 1, m - 1]
+        t = 1
+        for i in range(m - 1, 0, -1):
+            t = t * int(h[i, i - 1]) % mod_val
+            weights[i - 1] = int(h[i - 1, m - 1]) * t % mod_val
+        shifted = np.zeros(n + 1, dtype=np.int64)
+        shifted[1:] = polys[m - 1, :n]
+        tail = mod_matmul(weights[None, :], polys[:m], mod_val)[0]
+        polys[m] = (shifted - tail) % mod_val
+    return polys[n]
+
+def poly_mul(f: np.ndarray, g: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # exact convolution mod p: split g in 15-bit limbs so every partial sum stays in int64
+    width = 15
+    lo = g & ((1 << width) - 1)
+    hi = g >> width
+    low = np.convolve(f, lo) % mod_val
+    high = np.convolve(f, hi) % mod_val
+    return (low + (high << width) % mod_val) % mod_val
+
+def poly_rem(f: np.ndarray, monic: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    n = len(monic) - 1
+    r = f.copy()
+    for k in range(len(r) - 1, n - 1, -1):
+        coef = int(r[k])
+        if coef:
+            r[k - n:k] = (r[k - n:k] - coef * monic[:n] % mod_val) % mod_val
+    return r[:n]
+
+def x_pow_mod(b: int, monic: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # x^b mod the characteristic polynomial, left-to-right square and multiply
+    n = len(monic) - 1
+    r = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return r
+    r[0] = 1
+    for bit in bin(b)[2:]:
+        r = poly_rem(poly_mul(r, r, mod_val), monic, mod_val)
+        if bit == "1":
+            r = np.concatenate([[0], r])
+            r = poly_rem(r, monic, mod_val)
+    return r
+
+def poly_eval(coeffs: np.ndarray, a: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # Paterson-Stockmeyer: powers A^0..A^s, then Horner in A^s over blocks of s
+    # coefficients, about 2*sqrt(n) products instead of n
+    n = a.shape[0]
+    s = max(1, isqrt(len(coeffs) - 1) + 1)
+    # every O(n^3) product below is Freivalds-checked while shared.verify_rounds is set
+    multiply = verified(serial(lambda x, y: mod_matmul(x, y, mod_val)), mod_val)
+    # A^0..A^(s-1) written straight into the rows of flat, no second copy
+    flat = np.empty((s, n * n), dtype=np.int64)
+    flat[0] = np.eye(n, dtype=np.int64).ravel()
+    step = a
+    for i in range(1, s):
+        flat[i] = step.ravel()
+        step = multiply([step], a)[0]
+
+    blocks = -(-len(coeffs) // s)
+    table = np.zeros((blocks, s), dtype=np.int64)
+    table.ravel()[:len(coeffs)] = coeffs
+
+    # every sum_i c_(js+i) A^i at once, a (blocks x s) by (s x n^2) product taken in
+    # column slices, so the float residues of flat are built once and never whole
+    combos = np.empty((blocks, n * n), dtype=np.int64)
+    width = max(n, -(-n * n // 16))
+    for start in range(0, n * n, width):
+        combos[:, start:start + width] = multiply([table], flat[:, start:start + width])[0]
+    del flat
+
+    ans = combos[blocks - 1].reshape(n, n)
+    for j in range(blocks - 2, -1, -1):
+        ans = (multiply([ans], step)[0] + combos[j].reshape(n, n)) % mod_val
+    return ans
+
+# bytes poly_eval may hold at once, A^0..A^(s-1) plus the block sums; larger matrices
+# stay on binary exponentiation whatever b is
+max_bytes = 2 << 30
+
+def charpoly_bytes(n: int) -> int:
+    s = isqrt(max(n, 1) - 1) + 1
+    return 16 * s * n * n
+
+# char_poly is timed on a leading block of at most this size and scaled by n^3
+probe_size = 128
+
+@lru_cache(maxsize=None)
+def unit_costs(n: int, mod_val: int = mod) -> Tuple[float, float, float]:
+    # measured seconds of one n x n mod_matmul, of one exponent bit of x_pow_mod at
+    # degree n, and of char_poly, whose O(n^3) elementwise passes run far below the
+    # BLAS rate of a product; none of them depends on the entries, so a random matrix will do
+    rng = np.random.default_rng(n)
+    a = rng.integers(0, mod_val, (n, n), dtype=np.int64)
+    # best of a few where one product is short enough for the timer noise to matter
+    product = float("inf")
+    for _ in range(3 if n <= probe_size else 1):
+        begin = perf_counter()
+        mod_matmul(a, a, mod_val)
+        product = min(product, perf_counter() - begin)
+
+    # a set bit of x_pow_mod on a dense remainder: the small exponents would leave it
+    # mostly zero, which poly_rem skips
+    bits = 4
+    monic = np.append(rng.integers(0, mod_val, n, dtype=np.int64), 1)
+    r = rng.integers(0, mod_val, n, dtype=np.int64)
+    begin = perf_counter()
+    for _ in range(bits):
+        square = poly_rem(poly_mul(r, r, mod_val), monic, mod_val)
+        poly_rem(np.concatenate([[0], square]), monic, mod_val)
+    bit = (perf_counter() - begin) / bits
+
+    m = min(n, probe_size)
+    begin = perf_counter()
+    char_poly(a[:m, :m], mod_val)
+    reduction = (perf_counter() - begin) * (n / m) ** 3
+    return product, bit, reduction
+
+def charpoly_seconds(n: int, b: int, mod_val: int = mod) -> Tuple[float, float]:
+    # (Cayley-Hamilton, binary exponentiation) estimated seconds for an n x n A^b
+    product, bit, reduction = unit_costs(n, mod_val)
+    s = isqrt(n - 1) + 1
+    # poly_eval: s - 1 powers, the Horner steps and about one product for the block sums
+    evaluation = (s + -(-n // s) - 1) * product
+    return reduction + b.bit_length() * bit + evaluation, len(exp_plan(b).steps) * product
+
+def use_charpoly(n: int, b: int, mod_val: int = mod) -> bool:
+    if n < 1 or b < n or not is_prime(mod_val) or charpoly_bytes(n) > max_bytes:
+        return False
+    # the evaluation alone is about 2*sqrt(n) products, short plans are settled unmeasured
+    if len(exp_plan(b).steps) <= 2 * (isqrt(n - 1) + 1):
+        return False
+    charpoly, binary = charpoly_seconds(n, b, mod_val)
+    return charpoly < binary
+
+def check_char_poly(monic: np.ndarray, a: np.ndarray, mod_val: int = mod):
+    # Cayley-Hamilton in Freivalds form: chi(A) r = 0 for random columns r, by Horner on
+    # the vectors; the n matrix-vector steps of the reduction are too thin to check one
+    # by one, this checks their result in n products against A^T prepared once
+    n = a.shape[0]
+    r = np.random.default_rng().integers(0, mod_val, (shared.verify_rounds, n), dtype=np.int64)
+    right = vetorizado.prepare_right(a.T, mod_val)
+    v = np.zeros_like(r)
+    for coef in monic[::-1]:
+        # rows of v are (A v)^T, so v A^T is one more Horner step
+        v = (vetorizado.mod_matmul_prepared(v, right, mod_val) + int(coef) * r % mod_val) % mod_val
+    if v.any():
+        raise VerificationError(["characteristic polynomial"])
+
+def mat_exp_charpoly(a: np.ndarray, b: int, mod_val: int = mod) -> np.ndarray:
+    # A^b = r(A) with r = x^b mod chi_A, by Cayley-Hamilton; needs a prime modulus
+    if a.shape[0] == 0:
+        return a.copy()
+    monic = char_poly(a, mod_val)
+    if shared.verify_rounds:
+        check_char_poly(monic, a, mod_val)
+    coeffs = x_pow_mod(b, monic, mod_val)
+    return poly_eval(coeffs, a, mod_val)
+
+def mat_exp_array_auto(a: np.ndarray, b: int, mod_val: int = mod) -> np.ndarray:
+    if use_charpoly(a.shape[0], b, mod_val):
+        return mat_exp_charpoly(a, b, mod_val)
+    return mat_exp_array(a, b, mod_val)
+
+def mat_exp(a: Matrix, b: int) -> Matrix:
+    return to_matrix(mat_exp_array_auto(to_array(a), b))
+
+if __name__ == "__main__":
+    import benchmark
+    benchmark.main(["--backend", "caracteristico"] + sys.argv[1:])
@@ -1,26 +1,91 @@
+import sys
 from mpi4py import MPI
 from time import perf_counter
-from typing import List, Optional
-from copy import deepcopy
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from typing import Callable, Dict, List, Optional, Tuple
+import shared
 from shared import *
+from paralelo import mat_mul_parallel, mat_mul_parallel_many
+
+try:
+    import numpy as np
+    from vetorizado import mod_matmul, mod_matmul_limbs, to_array, to_matrix, mat_exp_array
+    import strassen
+except ImportError:
+    np = None
 
 comm = MPI.COMM_WORLD
 rank = comm.Get_rank()
 size = comm.Get_size()
 
-def local_mat_mul(a: List[List[int]], b: List[List[int]]) -> List[List[int]]:
-    n = len(b)
-    rows = len(a)
-    partial_c = [[0] * n for _ in range(rows)]
-    
-    for i in range(rows):
-        for j in range(n):
-            for k in range(n):
-                partial_c[i][j] += a[i][k] * b[k][j]
-            partial_c[i][j] %= mod
-    return partial_c
-
-def distributed_matmul(a: Optional[List[List[int]]], b: Optional[List[List[int]]]) -> Optional[List[List[int]]]:
+# hybrid mode: a thread or process pool on each rank that splits the rank's rows
+# again, so MPI only has to span nodes and not every core (see start_local_pool)
+local_pool = None
+
+def start_local_pool(workers: int, kind: str = "threads"):
+    global local_pool
+    local_pool = ThreadPool(workers) if kind == "threads" else Pool(workers)
+    return local_pool
+
+def node_layout() -> Tuple[int, int]:
+    # (nodes, ranks on this rank's node), ranks sharing memory count as one node
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    ranks_per_node = node_comm.Get_size()
+    nodes = comm.allreduce(1 if node_comm.Get_rank() == 0 else 0)
+    node_comm.Free()
+    return nodes, ranks_per_node
+
+def local_mat_mul(a: Matrix, b: Matrix) -> Matrix:
+    if local_pool is not None:
+        return mat_mul_parallel(a, b, local_pool)
+    if shared.kernel == "numpy":
+        return to_matrix(mod_matmul(to_array(a), to_array(b)))
+    return mat_mul_packed(operand(a), pack_rows(operand(b)), len(b))
+
+# per product phase records of distributed_matmul(_many) on this rank, kept only while
+# this is a list; bytes are the payloads this rank received and sent, none on rank 0
+collective_phases = ["scatter", "bcast", "compute", "gather"]
+phase_log = None
+
+def log_collectives(marks: List[float], payloads: List[Matrix]):
+    if phase_log is not None:
+        record = {phase: end - start for phase, start, end in zip(collective_phases, marks, marks[1:])}
+        record["bytes"] = 0 if rank == 0 else sum(payload.data.nbytes for payload in payloads)
+        phase_log.append(record)
+
+def local_products(compute, lefts: List[Matrix], n: int) -> Tuple[List[Matrix], List[str]]:
+    # in hybrid mode the local pool checks its own tiles; a failure there must not
+    # leave this rank out of the collectives, so it is kept and reported with the rest
+    try:
+        return compute(), []
+    except VerificationError as error:
+        return [Matrix(len(left), n) for left in lefts], [f"rank {rank} {block}" for block in error.blocks]
+
+def broadcast_verdict(check: Callable[[], List[str]]):
+    # rank 0 runs check, then the verdict is broadcast so that all ranks raise together
+    # instead of hanging; a check that could not run counts as failed
+    wrong = None
+    if rank == 0:
+        try:
+            wrong = check()
+        except Exception as error:
+            wrong = [f"rank 0 check ({type(error).__name__}: {error})"]
+    wrong = comm.bcast(wrong, root=0)
+    if wrong:
+        raise VerificationError(wrong)
+
+def verify_ranks(lefts: List, b, products: List, wrong: Optional[List[str]] = None):
+    # rank 0 checks every product against the row blocks the ranks sent back
+    wrong = comm.gather(wrong or [], root=0)
+    def check() -> List[str]:
+        ranges = row_ranges(len(b), size)
+        bad = {r for left, product in zip(lefts, products) for r in verify_product(left, b, product, ranges)}
+        return [f"rank {r}" for r in sorted(bad)] + [block for blocks in wrong for block in blocks]
+    broadcast_verdict(check)
+
+def distributed_matmul(a: Optional[Matrix], b: Optional[Matrix]) -> Optional[Matrix]:
+    marks = [perf_counter()]
     # cut into chunks
     chunks_a = None
     if rank == 0 and a is not None:
@@ -36,41 +101,528 @@ def distributed_matmul(a: Optional[List[List[int]]], b: Optional[List[List[int]]
 
     # send chunk_A and B
     chunk_a = comm.scatter(chunks_a, root=0)
+    marks.append(perf_counter())
     b_local = comm.bcast(b if rank == 0 else None, root=0)
+    marks.append(perf_counter())
 
     # calculate
-    local_ans = local_mat_mul(chunk_a, b_local)
+    (local_ans,), wrong = local_products(lambda: [local_mat_mul(chunk_a, b_local)], [chunk_a], len(b_local))
+    marks.append(perf_counter())
 
     # gather answer
     list_of_chunks = comm.gather(local_ans, root=0)
+    marks.append(perf_counter())
+    log_collectives(marks, [chunk_a, b_local, local_ans])
     ans = None
     if rank == 0:
-        ans = []
-        for chunk in list_of_chunks:
-            ans.extend(chunk)
-    
+        ans = Matrix.stack(list_of_chunks)
+    if shared.verify_rounds:
+        verify_ranks([a], b, [ans], wrong)
     return ans
 
-def mat_exp_mpi(a: Optional[List[List[int]]], b: int) -> Optional[List[List[int]]]:
-    ans = None
+def distributed_matmul_many(lefts: List[Optional[Matrix]], b: Optional[Matrix]) -> List[Optional[Matrix]]:
+    # products that share b (ans*base and base*base) use one round of collectives
+    marks = [perf_counter()]
+    chunks = None
+    if rank == 0 and b is not None:
+        n = len(b)
+        chunks = [[left[start:end] for left in lefts] for start, end in row_ranges(n, size)]
+
+    local_lefts = comm.scatter(chunks, root=0)
+    marks.append(perf_counter())
+    b_local = comm.bcast(b if rank == 0 else None, root=0)
+    marks.append(perf_counter())
+
+    if local_pool is not None:
+        compute = lambda: mat_mul_parallel_many(local_lefts, b_local, local_pool)
+    else:
+        compute = lambda: [local_mat_mul(chunk, b_local) for chunk in local_lefts]
+    local, wrong = local_products(compute, local_lefts, len(b_local))
+    marks.append(perf_counter())
+
+    list_of_chunks = comm.gather(local, root=0)
+    marks.append(perf_counter())
+    log_collectives(marks, local_lefts + [b_local] + local)
+    products = [None] * len(lefts)
+    if rank == 0:
+        products = [Matrix.stack([chunk[i] for chunk in list_of_chunks]) for i in range(len(lefts))]
+    if shared.verify_rounds:
+        verify_ranks(lefts, b, products, wrong)
+    return products
+
+def mat_exp_mpi(a: Optional[Matrix], b: int) -> Optional[Matrix]:
     base = None
     if rank == 0 and a is not None:
-        n = len(a)
-        ans = mat_identity(n)
-        base = deepcopy(a)
-
-    while b:
-        if b & 1:
-            ans = distributed_matmul(ans, base)
-        base = distributed_matmul(base, base)
-        b //= 2
-        
+        base = as_matrix(a).reduced()
+
+    # every rank derives the same plan from b, so the collectives line up
+    identity = lambda: mat_identity(len(a)) if rank == 0 else None
+    return run_plan(exp_plan(b), base, distributed_matmul_many, identity)
+
+def mat_exp_many_mpi(a: Optional[Matrix], exponents: Optional[List[int]],
+                     cache: Optional[MatrixPowerCache] = power_cache) -> List[Optional[Matrix]]:
+    # the cache lives on rank 0; the other ranks only learn how many squarings it
+    # already has, so every rank runs the same collectives for the missing ones
+    exponents = comm.bcast(exponents if rank == 0 else None, root=0)
+    top = max(exponents, default=0).bit_length() - 1
+    key, chain = None, [None]
+    if rank == 0:
+        base = as_matrix(a).reduced()
+        key, chain = cache.lookup(base) if cache is not None else (None, [base])
+    have = comm.bcast(len(chain), root=0)
+    if rank != 0:
+        chain = [None] * have
+    extend_squarings(chain, top, distributed_matmul_many)
+    if rank == 0 and cache is not None and len(chain) > have:
+        cache.store(key, chain)
+    identity = lambda: mat_identity(len(a)) if rank == 0 else None
+    return combine_powers(chain[:top + 1], exponents, distributed_matmul_many, identity)
+
+def row_layout(n: int) -> Tuple[List[int], List[int]]:
+    # element counts and displacements of each rank's row block, remainder rows included
+    counts = [(end - start) * n for start, end in row_ranges(n, size)]
+    displs = [start * n for start, _ in row_ranges(n, size)]
+    return counts, displs
+
+def distributed_matmul_buffer(a: Optional["np.ndarray"], b: Optional["np.ndarray"], n: int) -> Tuple[Optional["np.ndarray"], int]:
+    counts, displs = row_layout(n)
+    itemsize = np.dtype(np.int64).itemsize
+
+    # send chunk_A and B
+    chunk_a = np.empty((counts[rank] // n, n), dtype=np.int64)
+    comm.Scatterv([a, counts, displs, MPI.INT64_T] if rank == 0 else None, chunk_a, root=0)
+    b_local = b if rank == 0 else np.empty((n, n), dtype=np.int64)
+    comm.Bcast(b_local, root=0)
+
+    # calculate
+    local_ans = mod_matmul(chunk_a, b_local)
+
+    # gather answer
+    ans = np.empty((n, n), dtype=np.int64) if rank == 0 else None
+    comm.Gatherv(local_ans, [ans, counts, displs, MPI.INT64_T] if rank == 0 else None, root=0)
+    if shared.verify_rounds:
+        verify_ranks([a], b, [ans])
+
+    # bytes that left their owner: scatter + gather of the non-root blocks, b to every other rank
+    moved = 2 * (n * n - counts[0]) * itemsize + (size - 1) * n * n * itemsize
+    return ans, moved
+
+def distributed_matmul_buffer_many(lefts: List[Optional["np.ndarray"]], b: Optional["np.ndarray"], n: int) -> Tuple[List[Optional["np.ndarray"]], int]:
+    # each rank gets its rows of every left operand stacked together and
+    # multiplies them against the single broadcast of b
+    if len(lefts) == 1:
+        ans, moved = distributed_matmul_buffer(lefts[0], b, n)
+        return [ans], moved
+
+    stack = len(lefts)
+    counts, displs = row_layout(n)
+    counts = [stack * count for count in counts]
+    displs = [stack * displ for displ in displs]
+    ranges = row_ranges(n, size)
+    itemsize = np.dtype(np.int64).itemsize
+
+    packed = None
+    if rank == 0:
+        packed = np.concatenate([np.concatenate([left[start:end] for left in lefts]) for start, end in ranges])
+    local = np.empty((counts[rank] // n, n), dtype=np.int64)
+    comm.Scatterv([packed, counts, displs, MPI.INT64_T] if rank == 0 else None, local, root=0)
+    b_local = b if rank == 0 else np.empty((n, n), dtype=np.int64)
+    comm.Bcast(b_local, root=0)
+
+    local_ans = mod_matmul(local, b_local)
+
+    result = np.empty((stack * n, n), dtype=np.int64) if rank == 0 else None
+    comm.Gatherv(local_ans, [result, counts, displs, MPI.INT64_T] if rank == 0 else None, root=0)
+
+    products = [None] * stack
+    if rank == 0:
+        products = [np.empty((n, n), dtype=np.int64) for _ in lefts]
+        for (start, end), displ in zip(ranges, displs):
+            rows = end - start
+            block = result.reshape(-1)[displ:displ + stack * rows * n].reshape(stack, rows, n)
+            for product, part in zip(products, block):
+                product[start:end] = part
+    if shared.verify_rounds:
+        verify_ranks(lefts, b, products)
+
+    moved = 2 * (stack * n * n - counts[0]) * itemsize + (size - 1) * n * n * itemsize
+    return products, moved
+
+def mat_exp_mpi_buffer(a: Optional[Matrix], b: int, n: int) -> Tuple[Optional["np.ndarray"], List[int]]:
+    base = to_array(a) if rank == 0 and a is not None else None
+
+    traffic = []
+    def mul_many(lefts, right):
+        products, moved = distributed_matmul_buffer_many(lefts, right, n)
+        traffic.append(moved)
+        return products
+
+    identity = lambda: np.eye(n, dtype=np.int64) if rank == 0 else None
+    ans = run_plan(exp_plan(b), base, mul_many, identity)
+    return ans, traffic
+
+phases = ["scatter", "panel_wait", "compute", "result_wait"]
+
+def distributed_matmul_pipelined(a: Optional["np.ndarray"], b: Optional["np.ndarray"], n: int, panels: int = 4) -> Tuple[Optional["np.ndarray"], Dict[str, float]]:
+    # b goes out as column panels with Ibcast, panel k+1 is in flight while panel k is
+    # multiplied, and every finished (rows x panel) block leaves with an Isend
+    counts, displs = row_layout(n)
+    ranges = row_ranges(n, size)
+    start, end = ranges[rank]
+    cols = row_ranges(n, max(1, min(panels, n)))
+    timers = dict.fromkeys(phases, 0.0)
+
+    t = perf_counter()
+    chunk_a = np.empty((end - start, n), dtype=np.int64)
+    comm.Scatterv([a, counts, displs, MPI.INT64_T] if rank == 0 else None, chunk_a, root=0)
+    timers["scatter"] += perf_counter() - t
+
+    def post(k: int):
+        c0, c1 = cols[k]
+        panel = np.ascontiguousarray(b[:, c0:c1]) if rank == 0 else np.empty((n, c1 - c0), dtype=np.int64)
+        return panel, comm.Ibcast(panel, root=0)
+
+    ans = None
+    blocks = {}
+    requests = []
+    if rank == 0:
+        ans = np.empty((n, n), dtype=np.int64)
+        for r in range(1, size):
+            r0, r1 = ranges[r]
+            for k, (c0, c1) in enumerate(cols):
+                blocks[r, k] = np.empty((r1 - r0, c1 - c0), dtype=np.int64)
+                requests.append(comm.Irecv(blocks[r, k], source=r, tag=k))
+
+    in_flight = [post(0)]
+    for k, (c0, c1) in enumerate(cols):
+        if k + 1 < len(cols):
+            in_flight.append(post(k + 1))
+        panel, request = in_flight.pop(0)
+        t = perf_counter()
+        request.Wait()
+        timers["panel_wait"] += perf_counter() - t
+
+        t = perf_counter()
+        block = mod_matmul(chunk_a, panel)
+        timers["compute"] += perf_counter() - t
+        if rank == 0:
+            ans[start:end, c0:c1] = block
+        else:
+            blocks[rank, k] = block
+            requests.append(comm.Isend(block, dest=0, tag=k))
+
+    t = perf_counter()
+    MPI.Request.Waitall(requests)
+    timers["result_wait"] += perf_counter() - t
+    if rank == 0:
+        for (r, k), block in blocks.items():
+            r0, r1 = ranges[r]
+            c0, c1 = cols[k]
+            ans[r0:r1, c0:c1] = block
+    if shared.verify_rounds:
+        verify_ranks([a], b, [ans])
+    return ans, timers
+
+def mat_exp_mpi_pipelined(a: Optional[Matrix], b: int, n: int, panels: int = 4) -> Tuple[Optional["np.ndarray"], List[Dict[str, float]]]:
+    base = to_array(a) if rank == 0 and a is not None else None
+
+    timings = []
+    def mul_many(lefts, right):
+        products = []
+        for left in lefts:
+            product, timers = distributed_matmul_pipelined(left, right, n, panels)
+            products.append(product)
+            timings.append(timers)
+        return products
+
+    identity = lambda: np.eye(n, dtype=np.int64) if rank == 0 else None
+    ans = run_plan(exp_plan(b), base, mul_many, identity)
+    return ans, timings
+
+def mat_exp_mpi_resident(a: Optional[Matrix], b: int, n: int) -> Tuple[Optional["np.ndarray"], List[int]]:
+    counts, displs = row_layout(n)
+    itemsize = np.dtype(np.int64).itemsize
+    start, end = row_ranges(n, size)[rank]
+
+    # every plan register lives on the ranks as row blocks for the whole run
+    base_rows = np.empty((end - start, n), dtype=np.int64)
+    comm.Scatterv([to_array(a), counts, displs, MPI.INT64_T] if rank == 0 else None, base_rows, root=0)
+
+    traffic = []
+    def mul_many(lefts, right_rows):
+        # the full right operand is the only thing exchanged per step
+        right = np.empty((n, n), dtype=np.int64)
+        comm.Allgatherv(right_rows, [right, counts, displs, MPI.INT64_T])
+        traffic.append((size - 1) * n * n * itemsize)
+        products = [mod_matmul(left, right) for left in lefts]
+        if shared.verify_rounds:
+            # rank 0 never holds the registers, so each rank checks its own rows
+            bad = comm.allgather(any(verify_product(left, right, product) for left, product in zip(lefts, products)))
+            if any(bad):
+                raise VerificationError([f"rank {r}" for r, wrong in enumerate(bad) if wrong])
+        return products
+
+    identity = lambda: np.eye(n, dtype=np.int64)[start:end]
+    ans_rows = np.ascontiguousarray(run_plan(exp_plan(b), base_rows, mul_many, identity))
+
+    ans = np.empty((n, n), dtype=np.int64) if rank == 0 else None
+    comm.Gatherv(ans_rows, [ans, counts, displs, MPI.INT64_T] if rank == 0 else None, root=0)
+    return ans, traffic
+
+def grid_shape() -> Tuple[int, int]:
+    rows, cols = MPI.Compute_dims(size, 2)
+    return rows, cols
+
+class Grid:
+    # 2D process grid: rank (i, j) owns the block rows_i x cols_j of every matrix
+    def __init__(self, n: int):
+        self.n = n
+        self.shape = grid_shape()
+        self.cart = comm.Create_cart(self.shape)
+        self.coords = self.cart.Get_coords(self.cart.Get_rank())
+        # ranks inside row_comm follow the column coordinate and vice versa
+        self.row_comm = self.cart.Sub([False, True])
+        self.col_comm = self.cart.Sub([True, False])
+        self.row_ranges = row_ranges(n, self.shape[0])
+        self.col_ranges = row_ranges(n, self.shape[1])
+        # k panels: every boundary of either split, so each panel has one owner in both
+        cuts = sorted({start for start, _ in self.row_ranges + self.col_ranges} | {n})
+        self.panels = [(k0, k1) for k0, k1 in zip(cuts, cuts[1:]) if k0 < k1]
+
+    def block(self, coords: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        r0, r1 = self.row_ranges[coords[0]]
+        c0, c1 = self.col_ranges[coords[1]]
+        return r0, r1, c0, c1
+
+    def layout(self) -> Tuple[List[int], List[int], List[Tuple[int, int, int, int]]]:
+        blocks = [self.block(self.cart.Get_coords(r)) for r in range(size)]
+        counts = [(r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in blocks]
+        displs = [sum(counts[:r]) for r in range(size)]
+        return counts, displs, blocks
+
+    def scatter(self, a: Optional["np.ndarray"]) -> "np.ndarray":
+        counts, displs, blocks = self.layout()
+        packed = None
+        if self.cart.Get_rank() == 0:
+            packed = np.concatenate([a[r0:r1, c0:c1].ravel() for r0, r1, c0, c1 in blocks])
+        r0, r1, c0, c1 = self.block(self.coords)
+        local = np.empty((r1 - r0, c1 - c0), dtype=np.int64)
+        self.cart.Scatterv([packed, counts, displs, MPI.INT64_T] if packed is not None else None, local, root=0)
+        return local
+
+    def gather(self, local: "np.ndarray") -> Optional["np.ndarray"]:
+        counts, displs, blocks = self.layout()
+        root = self.cart.Get_rank() == 0
+        packed = np.empty(self.n * self.n, dtype=np.int64) if root else None
+        self.cart.Gatherv(np.ascontiguousarray(local), [packed, counts, displs, MPI.INT64_T] if root else None, root=0)
+        if not root:
+            return None
+        ans = np.empty((self.n, self.n), dtype=np.int64)
+        for (r0, r1, c0, c1), count, displ in zip(blocks, counts, displs):
+            ans[r0:r1, c0:c1] = packed[displ:displ + count].reshape(r1 - r0, c1 - c0)
+        return ans
+
+    def identity(self) -> "np.ndarray":
+        r0, r1, c0, c1 = self.block(self.coords)
+        return np.eye(self.n, dtype=np.int64)[r0:r1, c0:c1].copy()
+
+    def free(self):
+        self.row_comm.Free()
+        self.col_comm.Free()
+        self.cart.Free()
+
+def summa(grid: Grid, a: "np.ndarray", b: "np.ndarray") -> Tuple["np.ndarray", int]:
+    row, col = grid.coords
+    r0, r1, c0, c1 = grid.block(grid.coords)
+    itemsize = np.dtype(np.int64).itemsize
+    # a may hold several left operands stacked by rows, they all share the B panels
+    c = np.zeros((a.shape[0], c1 - c0), dtype=np.int64)
+    moved = 0
+    for k0, k1 in grid.panels:
+        width = k1 - k0
+        # owner of A[:, k0:k1] inside this grid row, owner of B[k0:k1, :] inside this grid column
+        owner_col = next(j for j, (s, e) in enumerate(grid.col_ranges) if s <= k0 < e)
+        owner_row = next(i for i, (s, e) in enumerate(grid.row_ranges) if s <= k0 < e)
+
+        if col == owner_col:
+            start = grid.col_ranges[owner_col][0]
+            a_panel = np.ascontiguousarray(a[:, k0 - start:k1 - start])
+        else:
+            a_panel = np.empty((a.shape[0], width), dtype=np.int64)
+        grid.row_comm.Bcast(a_panel, root=owner_col)
+
+        if row == owner_row:
+            start = grid.row_ranges[owner_row][0]
+            b_panel = np.ascontiguousarray(b[k0 - start:k1 - start, :])
+        else:
+            b_panel = np.empty((width, c1 - c0), dtype=np.int64)
+        grid.col_comm.Bcast(b_panel, root=owner_row)
+
+        c += mod_matmul(a_panel, b_panel)
+        c %= mod
+        moved += (a_panel.size * (col != owner_col) + b_panel.size * (row != owner_row)) * itemsize
+    return c, moved
+
+def verify_summa(grid: Grid, a: "np.ndarray", b: "np.ndarray", c: "np.ndarray"):
+    # Freivalds on the grid, nobody holds a whole matrix: for random columns r_j of every
+    # grid column j, v_j = B[:, cols_j] r_j is summed down the grid column, A[rows_i, :] v_j
+    # across the grid row, and rank (i, j) compares it with its own C_ij r_j
+    col = grid.coords[1]
+    r0, r1, c0, c1 = grid.block(grid.coords)
+    rounds = shared.verify_rounds
+    r = comm.bcast(np.random.default_rng().integers(0, mod, (grid.n, rounds), dtype=np.int64) if rank == 0 else None, root=0)
+
+    v = np.zeros((grid.n, rounds), dtype=np.int64)
+    v[r0:r1] = mod_matmul_limbs(b, r[c0:c1])
+    grid.col_comm.Allreduce(MPI.IN_PLACE, v, op=MPI.SUM)
+    v %= mod
+    # one v_j per grid column, in column order, then every A_ik v_j[cols_k] at once
+    vs = grid.row_comm.allgather(v)
+    expected = mod_matmul_limbs(a, np.concatenate([v_j[c0:c1] for v_j in vs], axis=1))
+    grid.row_comm.Allreduce(MPI.IN_PLACE, expected, op=MPI.SUM)
+    expected %= mod
+    mine = expected[:, col * rounds:(col + 1) * rounds]
+    wrong = not entries_in_range(as_checked(c)) or bool((mod_matmul_limbs(c, r[c0:c1]) != mine).any())
+    bad = comm.allgather(wrong)
+    if any(bad):
+        blocks = [grid.block(grid.cart.Get_coords(i)) for i in range(size)]
+        raise VerificationError([f"rank {i} rows {blocks[i][0]}:{blocks[i][1]} cols {blocks[i][2]}:{blocks[i][3]}"
+                                 for i, flag in enumerate(bad) if flag])
+
+def mat_exp_mpi_summa(a: Optional[Matrix], b: int, n: int) -> Tuple[Optional["np.ndarray"], List[int]]:
+    rows, cols = grid_shape()
+    if rows == 1 or cols == 1:
+        # prime rank counts only give a 1 x P grid, the row split is the same thing
+        return mat_exp_mpi_resident(a, b, n)
+
+    grid = Grid(n)
+    base = grid.scatter(to_array(a) if rank == 0 else None)
+
+    traffic = []
+    def mul_many(lefts, right):
+        # lefts are stacked by rows so each B panel is broadcast once for all of them
+        left = np.concatenate(lefts)
+        stacked, moved = summa(grid, left, right)
+        traffic.append(comm.allreduce(moved))
+        if shared.verify_rounds:
+            verify_summa(grid, left, right, stacked)
+        rows = len(lefts[0])
+        return [stacked[i * rows:(i + 1) * rows] for i in range(len(lefts))]
+
+    ans = grid.gather(run_plan(exp_plan(b), base, mul_many, grid.identity))
+    grid.free()
+    return ans, traffic
+
+def distributed_matmul_strassen(a: Optional["np.ndarray"], b: Optional["np.ndarray"], n: int) -> Optional["np.ndarray"]:
+    # rank 0 does one Strassen-Winograd level and deals the 7 products round-robin,
+    # every rank recurses locally on its share
+    shares = None
+    if rank == 0:
+        pairs = strassen.subproducts(a, b)
+        shares = [list(enumerate(pairs))[r::size] for r in range(size)]
+    mine = comm.scatter(shares, root=0)
+    local = [(i, strassen.strassen(x, y)) for i, (x, y) in mine]
+    gathered = comm.gather(local, root=0)
+    ans = None
+    if rank == 0:
+        products = [None] * 7
+        for chunk in gathered:
+            for i, product in chunk:
+                products[i] = product
+        ans = strassen.combine(products, n)
+    if shared.verify_rounds:
+        # the whole product on rank 0, and only when it fails the 7 products, to name the ranks
+        def check() -> List[str]:
+            if not verify_product(a, b, ans):
+                return []
+            return [f"rank {i % size} strassen product {i}" for i in strassen.wrong_subproducts(pairs, products)] or ["rank 0 combine"]
+        broadcast_verdict(check)
     return ans
 
+def share_strassen_cutoff() -> int:
+    # measured on rank 0 only, so every rank recurses to the same depth
+    strassen.cutoff = comm.bcast(strassen.ensure_cutoff() if rank == 0 else None, root=0)
+    strassen.calibrated = True
+    return strassen.cutoff
+
+def mat_exp_mpi_strassen(a: Optional[Matrix], b: int, n: int) -> Optional["np.ndarray"]:
+    base = to_array(a) if rank == 0 and a is not None else None
+    mul_many = lambda lefts, right: [distributed_matmul_strassen(left, right, n) for left in lefts]
+    identity = lambda: np.eye(n, dtype=np.int64) if rank == 0 else None
+    return run_plan(exp_plan(b), base, mul_many, identity)
+
+def mat_exp_mpi_batch(jobs: Optional[List[Tuple[Matrix, int]]]) -> Optional[List["np.ndarray"]]:
+    # rank 0 plans the batch: large jobs run row-split over every rank, the rest are
+    # packed whole onto ranks by estimated cost and computed without communication
+    plan = None
+    local_jobs = None
+    if rank == 0:
+        costs = [job_cost(len(a), b) for a, b in jobs]
+        large, bins = plan_batch(costs, size)
+        plan = (len(jobs), [(i, len(jobs[i][0]), jobs[i][1]) for i in large])
+        local_jobs = [[(i, jobs[i][0], jobs[i][1]) for i in bin_] for bin_ in bins]
+    total, large = comm.bcast(plan, root=0)
+    mine = comm.scatter(local_jobs, root=0)
+
+    results = [None] * total if rank == 0 else None
+    for i, n, b in large:
+        ans, _ = mat_exp_mpi_resident(jobs[i][0] if rank == 0 else None, b, n)
+        if rank == 0:
+            results[i] = ans
+
+    # a wrong product in a bin is reported with the results, so no rank leaves the gather
+    local_results, wrong = [], []
+    for i, a, b in mine:
+        try:
+            local_results.append((i, mat_exp_array(to_array(a), b)))
+        except VerificationError as error:
+            wrong += [f"rank {rank} job {i} {block}" for block in error.blocks]
+    gathered = comm.gather((local_results, wrong), root=0)
+    for chunk, _ in gathered or []:
+        for i, ans in chunk:
+            results[i] = ans
+    if shared.verify_rounds:
+        broadcast_verdict(lambda: [block for _, blocks in gathered for block in blocks])
+    return results
+
 if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "pickle"
+    if mode == "hybrid":
+        # mpiexec -n <ranks> python distribuido.py hybrid <workers per rank> [threads|processes]
+        workers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+        kind = sys.argv[3] if len(sys.argv) > 3 else "threads"
+        nodes, ranks_per_node = node_layout()
+        start_local_pool(workers, kind)
     if rank == 0:
         durations = []
-        print(f"--- {size} Processes ---")
+        traffic_rows = []
+        print(f"--- {size} Processes ({mode}) ---")
+        if mode == "hybrid":
+            print(f"--- {nodes} nodes x {ranks_per_node} ranks x {workers} {kind} ---")
+        phase_rows = []
+    if mode in ("pickle", "hybrid"):
+        phase_log = []
+    if mode == "strassen":
+        cutoff = share_strassen_cutoff()
+        if rank == 0:
+            print(f"--- cutoff {cutoff} ---")
+    if mode == "pipelined":
+        # mpiexec -n <ranks> python distribuido.py pipelined <panels>, 1 panel is the blocking baseline
+        panels = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    if mode == "batch":
+        jobs = None
+        if rank == 0:
+            jobs = [(mat, b_val) for _, b_val, mat in map(read_input, range(testcases))]
+        comm.Barrier()
+        start = perf_counter()
+        mat_exp_mpi_batch(jobs)
+        comm.Barrier()
+        duration = perf_counter() - start
+        if rank == 0:
+            print(f"{len(jobs)} jobs | {duration:.4f}s | {len(jobs) / duration:.2f} jobs/s")
+            write_rows(f"distribuido_batch{size}", ["jobs", "duration"], [[len(jobs), duration]])
+        sys.exit()
 
     for i in range(testcases):
         n, b_val, mat = None, None, None
@@ -84,15 +636,59 @@ if __name__ == "__main__":
         
         comm.Barrier()
         start = perf_counter()
-        ans = mat_exp_mpi(mat, b_val)
+        if mode == "buffer":
+            ans, traffic = mat_exp_mpi_buffer(mat, b_val, n)
+        elif mode == "resident":
+            ans, traffic = mat_exp_mpi_resident(mat, b_val, n)
+        elif mode == "summa":
+            ans, traffic = mat_exp_mpi_summa(mat, b_val, n)
+        elif mode == "strassen":
+            ans = mat_exp_mpi_strassen(mat, b_val, n)
+        elif mode == "pipelined":
+            ans, timings = mat_exp_mpi_pipelined(mat, b_val, n, panels)
+        else:
+            ans = mat_exp_mpi(mat, b_val)
         comm.Barrier()
         end = perf_counter()
+        if mode == "pipelined":
+            # every rank's timers, gathered outside the timed region
+            all_timings = comm.gather(timings, root=0)
+            if rank == 0:
+                for r, rank_timings in enumerate(all_timings):
+                    phase_rows.extend([i, it, r] + [timers[phase] for phase in phases] for it, timers in enumerate(rank_timings))
+        elif phase_log is not None:
+            all_records = comm.gather(phase_log, root=0)
+            phase_log.clear()
+            if rank == 0:
+                for r, records in enumerate(all_records):
+                    phase_rows.extend([i, it, r] + [record[phase] for phase in collective_phases] + [record["bytes"]]
+                                      for it, record in enumerate(records))
 
         if rank == 0:
             duration = end - start
             durations.append(duration)
-            print(f"{duration:.4f}s")
+            if mode in ("buffer", "resident", "summa"):
+                traffic_rows.extend([i, it, moved] for it, moved in enumerate(traffic))
+                print(f"{duration:.4f}s | {sum(traffic) / max(len(traffic), 1) / 2**20:.2f} MiB/iter")
+            else:
+                print(f"{duration:.4f}s")
 
     if rank == 0:
-        write_output(f"distribuido{size}", durations)
-        print("--- FIM ---")
\ No newline at end of file
+        if mode in ("buffer", "resident", "summa"):
+            write_output(f"distribuido_{mode}{size}", durations)
+            write_rows(f"distribuido_{mode}{size}_bytes", ["test", "iteration", "bytes"], traffic_rows)
+        elif mode == "strassen":
+            write_output(f"distribuido_strassen{size}", durations)
+        elif mode == "pipelined":
+            write_output(f"distribuido_pipelined{panels}p{size}", durations)
+            write_rows(f"distribuido_pipelined{panels}p{size}_phases", ["test", "iteration", "rank"] + phases, phase_rows)
+        elif mode == "hybrid":
+            name = f"hibrido_{nodes}x{ranks_per_node}x{workers}_{kind}"
+            write_output(name, durations)
+            write_rows(f"{name}_phases", ["test", "iteration", "rank"] + collective_phases + ["bytes"], phase_rows)
+        else:
+            write_output(f"distribuido{size}", durations)
+            write_rows(f"distribuido{size}_phases", ["test", "iteration", "rank"] + collective_phases + ["bytes"], phase_rows)
+        print("--- FIM ---")
+    if local_pool is not None:
+        local_pool.terminate()
\ No newline at end of file
@@ -1,59 +1,8 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-import seaborn as sns
-import numpy as np
 import os
-from shared import read_input, testcases, output_folder
-
-# Configuração Visual
-sns.set_theme(style="whitegrid")
-
-# Mapeamento dos Arquivos
-FILES_MAP = {
-    "Sequencial": "sequencial.csv",
-    "Paralelo (2 Cores)": "paralelo2.csv",
-    "Paralelo (4 Cores)": "paralelo4.csv",
-    "Paralelo (8 Cores)": "paralelo8.csv",
-    "Distribuido (2 Nós)": "distribuido2.csv",
-    "Distribuido (4 Nós)": "distribuido4.csv",
-    "Distribuido (8 Nós)": "distribuido8.csv"
-}
-
-def carregar_dados():
-    map_id_to_n = []
-    for i in range(testcases):
-        try:
-            n, _, _ = read_input(i)
-            map_id_to_n.append(n)
-        except:
-            break
-            
-    data_frames = []
-    
-    for label, filename in FILES_MAP.items():
-        path = os.path.join(output_folder, filename)
-        if not os.path.exists(path):
-            print(f"[AVISO] {filename} não encontrado. Ignorando.")
-            continue
-            
-        df = pd.read_csv(path)
-        limit = min(len(df), len(map_id_to_n))
-        df = df.iloc[:limit]
-        df['N'] = map_id_to_n[:limit]
-        df['Algoritmo'] = label.split()[0] 
-        
-        if "Sequencial" in label:
-            df['Cores'] = 1
-        else:
-            import re
-            nums = re.findall(r'\d+', label)
-            df['Cores'] = int(nums[0]) if nums else 1
-            
-        df['NomeCompleto'] = label
-        data_frames.append(df)
-    
-    if not data_frames: return None
-    return pd.concat(data_frames)
+import pandas as pd
+from shared import output_folder
+from analise import (carregar_dados, carregar_fases, resumir_fases, arquivos_testes, entradas,
+                     precisa_gerar, marcar_gerado, graficos)
 
 def calcular_metricas(df):
     # Agrupa por NomeCompleto e N -> Média de Tempo
@@ -87,7 +36,15 @@ def plot_generico(df, algoritmo, y_col, titulo, y_label, filename, paleta="virid
     """Função genérica para plotar qualquer métrica"""
     subset = df[(df['Algoritmo'] == algoritmo) & (df['Cores'] > 1)]
     if subset.empty: return
+    path = f"graficos/{filename}"
+    arquivos = entradas(subset, __file__)
+    if not precisa_gerar(path, arquivos): return
 
+    plt, sns = graficos()
+    if isinstance(paleta, dict):
+        # contagens de cores sem cor fixa (ex.: paralelo3.csv) pegam uma cor da viridis
+        extras = sorted(c for c in subset['Cores'].unique() if c not in paleta)
+        paleta = {**paleta, **dict(zip(extras, sns.color_palette("viridis", len(extras))))}
     plt.figure(figsize=(10, 6))
     sns.lineplot(data=subset, x='N', y=y_col, hue='Cores', palette=paleta, marker="o", linewidth=2.5)
     
@@ -97,13 +54,37 @@ def plot_generico(df, algoritmo, y_col, titulo, y_label, filename, paleta="virid
     plt.xticks(subset['N'].unique())
     plt.legend(title="Núcleos")
     
-    path = f"graficos/{filename}"
     plt.savefig(path)
     plt.close()
+    marcar_gerado(path, arquivos)
     print(f"Gerado: {path}")
 
+def plot_fases(resumo, fases):
+    """Barras empilhadas: onde o tempo de cada execução é gasto, por N"""
+    for nome, subset in resumo.groupby('NomeCompleto'):
+        path = f"graficos/fases_{nome}.png"
+        arquivos = [os.path.join(output_folder, f"{nome}_phases.csv")] + arquivos_testes() + [__file__]
+        if not precisa_gerar(path, arquivos): continue
+
+        plt, _ = graficos()
+        colunas = [f for f in fases if subset[f].notna().any()]
+        ax = subset.set_index('N')[colunas].plot(kind='bar', stacked=True, figsize=(10, 6), colormap="viridis")
+        ax.set_title(f"Tempo por Fase - {nome}", fontsize=16)
+        ax.set_ylabel("Segundos (média por teste)")
+        ax.set_xlabel("Tamanho da Matriz (N)")
+        ax.legend(title="Fase")
+
+        plt.savefig(path)
+        plt.close()
+        marcar_gerado(path, arquivos)
+        print(f"Gerado: {path}")
+
 def main():
     os.makedirs("graficos", exist_ok=True)
+
+    fases_df = carregar_fases()
+    if fases_df is not None:
+        plot_fases(*resumir_fases(fases_df))
     
     raw_df = carregar_dados()
     if raw_df is None: return
@@ -111,8 +92,11 @@ def main():
     stats_df = calcular_metricas(raw_df)
     
     # Salva CSV com todas as métricas para você conferir
-    stats_df.to_csv("metricas_completas.csv", index=False)
-    print("Dados salvos em 'metricas_completas.csv'")
+    arquivos = entradas(raw_df, __file__)
+    if precisa_gerar("metricas_completas.csv", arquivos):
+        stats_df.to_csv("metricas_completas.csv", index=False)
+        marcar_gerado("metricas_completas.csv", arquivos)
+        print("Dados salvos em 'metricas_completas.csv'")
     
     minhas_cores = {
         2: "red",
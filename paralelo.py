@@ -1,72 +1,462 @@
+import sys
+from array import array
+from itertools import count
 from time import perf_counter
-from multiprocessing import Pool, cpu_count
-from typing import List
-from copy import deepcopy
+from multiprocessing import Barrier, Pipe, Pool, Process, cpu_count, resource_tracker, shared_memory
+from multiprocessing.pool import ThreadPool
+from typing import List, Optional, Tuple
+import shared
 from shared import *
+import sequencial
 
-def worker_task(rows_a: List[List[int]], b: List[List[int]], mod_val: int) -> List[List[int]]:
+try:
+    import numpy as np
+    import strassen
+    import vetorizado
+    from vetorizado import mod_matmul, to_array, to_matrix
+except ImportError:
+    np = None
+
+
+def prepare_right(b: Matrix, mod_val: int):
+    # the form of b the kernel multiplies by, built once for all the rows it meets:
+    # reduced array with its residues, or packed rows
+    if shared.kernel == "numpy":
+        return vetorizado.prepare_right(b, mod_val)
+    return pack_rows(operand(b, mod_val), mod_val)
+
+def multiply_prepared(rows_a: Matrix, right, n: int, mod_val: int) -> Matrix:
+    if shared.kernel == "numpy":
+        return to_matrix(vetorizado.mod_matmul_prepared(to_array(rows_a, mod_val), right, mod_val))
+    return mat_mul_packed(operand(rows_a, mod_val), right, n, mod_val)
+
+def worker_task(rows_a: Matrix, b: Matrix, mod_val: int) -> Matrix:
+    return multiply_prepared(rows_a, prepare_right(b, mod_val), len(b), mod_val)
+
+# rows per tile, 0 lets auto_tile pick it from N and the worker count
+tile_rows = 0
+tiles_per_worker = 4
+min_tile_rows = 32
+
+def auto_tile(n: int, workers: int) -> int:
+    # several tiles per worker, so whoever finishes first takes the next one and a slow
+    # worker no longer holds up the product; every tile is one more task to pickle and
+    # return, so tiles stay at least min_tile_rows long unless that would leave workers idle
+    balanced = -(-n // (workers * tiles_per_worker))
+    floor = min(min_tile_rows, -(-n // workers))
+    return max(1, balanced, floor)
+
+def tile_ranges(n: int, workers: int) -> List[Tuple[int, int]]:
+    size = tile_rows or auto_tile(n, workers)
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+# b of the product in flight, as seen by a pool worker: tiles only carry their rows of
+# a and the name of the shared memory block holding b, which each worker reads and
+# prepares once per product
+_right = None
+
+# whether this worker's resource tracker is its own instead of the parent's, settled
+# by the first attach
+_own_tracker = None
+
+def attach_block(name: str) -> shared_memory.SharedMemory:
+    # the parent creates and unlinks the block, and its tracker starts with the first
+    # one; a worker forked before that has no tracker, starts its own on attach and
+    # would have it report every block as leaked at exit, so it takes them off again
+    global _own_tracker
+    if _own_tracker is None:
+        _own_tracker = resource_tracker._resource_tracker._fd is None
+    block = shared_memory.SharedMemory(name=name)
+    if _own_tracker:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+def shared_right(name: str, n: int, mod_val: int):
+    global _right
+    if _right is None or _right[0] != name:
+        block = attach_block(name)
+        _right = (name, prepare_right(Matrix(n, n, block.buf[:8 * n * n]), mod_val))
+        block.close()
+    return _right[1]
+
+def tile_task(task: Tuple[int, int, Matrix, object, int, int]) -> Tuple[int, int, Matrix, float]:
+    # right is the prepared b on a thread pool and the name of its block on a process pool
+    index, start, rows_a, right, n, mod_val = task
+    begin = perf_counter()
+    if isinstance(right, str):
+        right = shared_right(right, n, mod_val)
+    partial = multiply_prepared(rows_a, right, n, mod_val)
+    return index, start, partial, perf_counter() - begin
+
+# per product phase records of mat_mul_parallel_many, kept only while this is a list:
+# chunking, dispatch (pickling, queues and idle workers), compute (worker seconds over
+# the worker count), reassembly, and the bytes of the tiles, the one copy of b and results
+parallel_phases = ["chunking", "dispatch", "compute", "reassembly"]
+phase_log = None
+
+def mat_mul_parallel(a: Matrix, b: Matrix, pool: Pool) -> Matrix:
+    return mat_mul_parallel_many([a], b, pool)[0]
+
+def mat_mul_parallel_many(lefts: List[Matrix], b: Matrix, pool: Pool) -> List[Matrix]:
+    # products that share b (ans*base and base*base) go out as one stream of tiles,
+    # handed out as workers free up and written into place as they come back
+    begin = perf_counter()
     n = len(b)
-    partial = [[0]*n for _ in range(len(rows_a))]
-    
-    for i in range(len(rows_a)):
-        for j in range(n):
-            for k in range(n):
-                partial[i][j] += rows_a[i][k] * b[k][j]
-            partial[i][j] %= mod_val
-        
-    return partial
-
-def mat_mul_parallel(a: List[List[int]], b: List[List[int]], pool: Pool) -> List[List[int]]:
+    products = [Matrix(len(left), n) for left in lefts]
+    # b goes into shared memory once per call instead of being pickled into every tile;
+    # threads share the parent's memory and get it already prepared
+    block = right = None
+    if isinstance(pool, ThreadPool):
+        right = prepare_right(b, mod)
+    else:
+        block = shared_memory.SharedMemory(create=True, size=max(1, 8 * n * n))
+        block.buf[:8 * n * n] = as_matrix(b).data.cast('B')
+        right = block.name
+    tasks = [(index, start, left[start:end], right, n, mod)
+             for index, left in enumerate(lefts)
+             for start, end in tile_ranges(len(left), pool._processes)]
+    dispatched = perf_counter()
+
+    compute = reassembly = 0.0
+    try:
+        for index, start, partial, seconds in pool.imap_unordered(tile_task, tasks):
+            placed = perf_counter()
+            products[index].data[start * n:(start + partial.rows) * n] = partial.data
+            reassembly += perf_counter() - placed
+            compute += seconds
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+    done = perf_counter()
+
+    if phase_log is not None:
+        compute /= pool._processes
+        moved = 0 if block is None else 8 * n * n + sum(2 * rows_a.data.nbytes for _, _, rows_a, _, _, _ in tasks)
+        phase_log.append({"chunking": dispatched - begin, "dispatch": max(0.0, done - dispatched - reassembly - compute),
+                          "compute": compute, "reassembly": reassembly, "bytes": moved})
+    if shared.verify_rounds:
+        bad = []
+        for index, (left, product) in enumerate(zip(lefts, products)):
+            tiles = tile_ranges(len(left), pool._processes)
+            bad += [f"product {index} tile {tiles[i][0]}:{tiles[i][1]}" for i in verify_product(left, b, product, tiles)]
+        if bad:
+            raise VerificationError(bad)
+    return products
+
+def mat_exp(a: Matrix, b: int, pool: Pool) -> Matrix:
     n = len(a)
-    num_processes = pool._processes
-    
-    chunk_size = n // num_processes
-    chunks_a = []
-    
-    for i in range(num_processes):
-        start = i * chunk_size
-        end = n if i == num_processes - 1 else (i + 1) * chunk_size
-        chunks_a.append(a[start:end])
-    
-    tasks = [(chunk, b, mod) for chunk in chunks_a]
-    results = pool.starmap(worker_task, tasks)
-
-    c = []
-    for partial_result in results:
-        c.extend(partial_result)
-        
+    base = as_matrix(a).reduced()
+    mul_many = lambda lefts, right: mat_mul_parallel_many(lefts, right, pool)
+    return run_plan(exp_plan(b), base, mul_many, lambda: mat_identity(n))
+
+def mat_exp_many(a: Matrix, exponents: List[int], pool: Pool, cache: Optional[MatrixPowerCache] = power_cache) -> List[Matrix]:
+    n = len(a)
+    base = as_matrix(a).reduced()
+    mul_many = lambda lefts, right: mat_mul_parallel_many(lefts, right, pool)
+    return run_many(base, exponents, mul_many, lambda: mat_identity(n), cache)
+
+def mat_mul_strassen_parallel(a: "np.ndarray", b: "np.ndarray", pool: Pool) -> "np.ndarray":
+    # one Strassen-Winograd level in the parent, its 7 products recurse on the workers
+    pairs = strassen.subproducts(a, b)
+    products = pool.starmap(strassen.strassen_task, [(x, y, mod, strassen.cutoff) for x, y in pairs])
+    c = strassen.combine(products, a.shape[0])
+    if shared.verify_rounds and verify_product(a, b, c):
+        raise VerificationError([f"strassen product {i}" for i in strassen.wrong_subproducts(pairs, products)] or ["combine"])
     return c
 
-def mat_exp(a: List[List[int]], b: int, pool: Pool) -> List[List[int]]:
+def mat_exp_strassen(a: Matrix, b: int, pool: Pool) -> Matrix:
     n = len(a)
-    ans = mat_identity(n)
-    base = deepcopy(a)
-    
-    while b:
-        if b & 1:
-            ans = mat_mul_parallel(ans, base, pool)
-        base = mat_mul_parallel(base, base, pool)
-        b //= 2
-    return ans
+    mul_many = lambda lefts, right: [mat_mul_strassen_parallel(left, right, pool) for left in lefts]
+    return to_matrix(run_plan(exp_plan(b), to_array(a), mul_many, lambda: np.eye(n, dtype=np.int64)))
+
+def whole_exp_task(index: int, a: Matrix, b: int) -> Tuple[int, Matrix]:
+    # same shared.kernel as the row-split jobs, so a batch never mixes two kernels
+    return index, sequencial.mat_exp(a, b)
+
+def star_whole_exp_task(task: Tuple[int, Matrix, int]) -> Tuple[int, Matrix]:
+    return whole_exp_task(*task)
+
+def mat_exp_batch(jobs: List[Tuple[Matrix, int]], pool: Pool) -> List[Matrix]:
+    costs = [job_cost(len(a), b) for a, b in jobs]
+    large, bins = plan_batch(costs, pool._processes)
+    results = [None] * len(jobs)
+
+    for i in large:
+        a, b = jobs[i]
+        results[i] = mat_exp(a, b, pool)
+
+    # the pool hands the next job to whichever worker frees up first, so feeding
+    # the bins' jobs from most to least expensive gives the LPT schedule
+    order = sorted((i for bin_ in bins for i in bin_), key=lambda i: costs[i], reverse=True)
+    tasks = [(i, jobs[i][0], jobs[i][1]) for i in order]
+    for i, ans in pool.imap_unordered(star_whole_exp_task, tasks):
+        results[i] = ans
+    return results
+
+# worker side of the shared memory backend: the blocks are attached once, when the
+# pool starts, and every task only names the slots and the rows it must fill
+_blocks = []
+
+def attach_blocks(names: List[str]):
+    global _blocks
+    _blocks = [shared_memory.SharedMemory(name=name) for name in names]
+
+def block_view(block: shared_memory.SharedMemory, n: int) -> "np.ndarray":
+    return np.ndarray((n, n), dtype=np.int64, buffer=block.buf)
+
+def shm_worker_task(n: int, slot_a: int, slot_b: int, slot_c: int, start: int, end: int):
+    a = block_view(_blocks[slot_a], n)
+    b = block_view(_blocks[slot_b], n)
+    c = block_view(_blocks[slot_c], n)
+    c[start:end] = mod_matmul(a[start:end], b)
+
+class SharedPool:
+    def __init__(self, processes: int, capacity: int = 0, slots: int = 4):
+        if np is None:
+            raise RuntimeError("the shared memory backend needs numpy")
+        self.processes = processes
+        self.capacity = 0
+        self.blocks = []
+        self.pool = None
+        self.reserve(capacity, slots)
+
+    def reserve(self, n: int, slots: int = 0):
+        # workers attach at start-up, so growing the buffers means restarting the pool
+        if n <= self.capacity and slots <= len(self.blocks) and self.pool is not None:
+            return
+        slots = max(slots, len(self.blocks))
+        self.close()
+        self.capacity = max(n, self.capacity, 1)
+        size = self.capacity * self.capacity * 8
+        self.blocks = [shared_memory.SharedMemory(create=True, size=size) for _ in range(slots)]
+        self.pool = Pool(processes=self.processes, initializer=attach_blocks,
+                         initargs=([block.name for block in self.blocks],))
+
+    def view(self, slot: int, n: int) -> "np.ndarray":
+        return block_view(self.blocks[slot], n)
+
+    def multiply(self, n: int, *products: Tuple[int, int, int]):
+        # every (slot_a, slot_b, slot_c) product is split by rows and all of them
+        # share a single starmap, so independent products cost one barrier
+        tasks = [(n, slot_a, slot_b, slot_c, start, end)
+                 for slot_a, slot_b, slot_c in products
+                 for start, end in row_ranges(n, self.processes) if start < end]
+        self.pool.starmap(shm_worker_task, tasks)
+        if shared.verify_rounds:
+            ranges = row_ranges(n, self.processes)
+            bad = [f"slot {slot_c} rows {ranges[i][0]}:{ranges[i][1]}"
+                   for slot_a, slot_b, slot_c in products
+                   for i in verify_product(self.view(slot_a, n), self.view(slot_b, n), self.view(slot_c, n), ranges)]
+            if bad:
+                raise VerificationError(bad)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def mat_exp_shm(a: Matrix, b: int, shared_pool: SharedPool) -> Matrix:
+    # plan registers live in slots; a product writes into a free slot and slots
+    # come back to the free list after the register's last use
+    n = len(a)
+    plan = exp_plan(b)
+    shared_pool.reserve(n, plan_live_registers(plan))
+    free = list(range(len(shared_pool.blocks)))
+    base = free.pop()
+    shared_pool.view(base, n)[:] = to_array(a)
+
+    def mul_many(lefts: List[int], right: int) -> List[int]:
+        outs = [free.pop() for _ in lefts]
+        shared_pool.multiply(n, *((left, right, out) for left, out in zip(lefts, outs)))
+        return outs
+
+    ans = run_plan(plan, base, mul_many, lambda: None, free.append)
+    if ans is None:
+        return mat_identity(n)
+    return to_matrix(shared_pool.view(ans, n).copy())
+
+# worker side of the resident backend: each worker owns one row block of every plan
+# register for a whole exponentiation, the only thing exchanged per batch of products
+# is the right operand, through two shared blocks used in turns
+def resident_run(n: int, plan: ExpPlan, blocks: List[shared_memory.SharedMemory], barrier, index: int, processes: int,
+                 rounds: int = 0):
+    start, end = row_ranges(n, processes)[index]
+    exchanges = [Matrix(n, n, block.buf[:8 * n * n]) for block in blocks[:2]]
+    result = Matrix(n, n, blocks[2].buf[:8 * n * n])
+    turns = count()
+
+    def mul_many(lefts: List[Matrix], right_rows: Matrix) -> List[Matrix]:
+        # a block is rewritten two batches later, by then every worker has passed the
+        # next barrier and so has finished reading it
+        right = exchanges[next(turns) % 2]
+        right.data[start * n:end * n] = right_rows.data
+        barrier.wait()
+        products = [worker_task(left, right, mod) for left in lefts]
+        # each worker checks its own rows, right is already whole in the exchange block
+        if rounds and any(verify_product(left, right, product, rounds=rounds) for left, product in zip(lefts, products)):
+            raise VerificationError([f"worker {index} rows {start}:{end}"])
+        return products
+
+    ans = run_plan(plan, Matrix.stack([result[start:end]]), mul_many, lambda: mat_identity(n)[start:end])
+    result.data[start * n:end * n] = ans.data
+
+def resident_worker(conn, barrier, index: int, processes: int):
+    attached = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        n, plan, names, rounds = message
+        for name in [name for name in attached if name not in names]:
+            attached.pop(name).close()
+        for name in names:
+            if name not in attached:
+                attached[name] = shared_memory.SharedMemory(name=name)
+        try:
+            resident_run(n, plan, [attached[name] for name in names], barrier, index, processes, rounds)
+            conn.send(None)
+        except Exception as error:
+            # wakes the others out of the barrier, they report a BrokenBarrierError
+            barrier.abort()
+            conn.send(error)
+    for block in attached.values():
+        block.close()
+
+class ResidentPool:
+    def __init__(self, processes: int, capacity: int = 0):
+        self.processes = processes
+        self.barrier = Barrier(processes)
+        self.capacity = 0
+        self.blocks = []
+        # blocks exist before the workers start, so they share this process' resource
+        # tracker instead of starting their own, which unlinks the blocks when they exit
+        self.reserve(capacity)
+        self.conns = []
+        self.workers = []
+        for index in range(processes):
+            conn, child_conn = Pipe()
+            worker = Process(target=resident_worker, args=(child_conn, self.barrier, index, processes), daemon=True)
+            worker.start()
+            self.conns.append(conn)
+            self.workers.append(worker)
+
+    def reserve(self, n: int):
+        # two exchange blocks plus one that carries a in and the answer out
+        if n <= self.capacity and self.blocks:
+            return
+        self.release()
+        self.capacity = max(n, 1)
+        size = self.capacity * self.capacity * 8
+        self.blocks = [shared_memory.SharedMemory(create=True, size=size) for _ in range(3)]
+
+    def run(self, a: Matrix, plan: ExpPlan) -> Matrix:
+        n = len(a)
+        self.reserve(n)
+        self.blocks[2].buf[:8 * n * n] = a.data.cast('B')
+        names = [block.name for block in self.blocks]
+        for conn in self.conns:
+            conn.send((n, plan, names, shared.verify_rounds))
+        errors = [error for error in (conn.recv() for conn in self.conns) if error is not None]
+        if errors:
+            self.barrier.reset()
+            wrong = [block for error in errors if isinstance(error, VerificationError) for block in error.blocks]
+            if wrong:
+                raise VerificationError(wrong)
+            raise RuntimeError("a resident worker failed") from errors[0]
+        return Matrix(n, n, array('q', bytes(self.blocks[2].buf[:8 * n * n])))
+
+    def release(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+        self.capacity = 0
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+        self.conns = []
+        self.workers = []
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def mat_exp_resident(a: Matrix, b: int, resident_pool: ResidentPool) -> Matrix:
+    # the parent sends the plan and a once and reads the answer once
+    return resident_pool.run(as_matrix(a).reduced(), exp_plan(b))
 
 if __name__ == "__main__":
-    cores = int(input("How many cores will you use? "))
-    print(f"--- {cores} Cores ---")
+    backend = sys.argv[1] if len(sys.argv) > 1 else "pool"
+    cores = int(sys.argv[2]) if len(sys.argv) > 2 else int(input("How many cores will you use? "))
+    print(f"--- {cores} Cores ({backend}) ---")
+
+    if backend == "batch":
+        jobs = []
+        for i in range(testcases):
+            n, b, mat = read_input(i)
+            jobs.append((mat, b))
+        with Pool(processes=cores) as pool:
+            start_time = perf_counter()
+            mat_exp_batch(jobs, pool)
+            duration = perf_counter() - start_time
+        print(f"{len(jobs)} jobs | {duration:.4f}s | {len(jobs) / duration:.2f} jobs/s")
+        write_rows(f"paralelo_batch{cores}", ["jobs", "duration"], [[len(jobs), duration]])
+        sys.exit()
 
     durations = []
-    with Pool(processes=cores) as pool:
+    phase_rows = []
+    if backend in ("pool", "threads"):
+        phase_log = []
+    if backend == "strassen":
+        print(f"--- cutoff {strassen.ensure_cutoff()} ---")
+    # "threads" runs the same tiles on threads of this process: nothing is pickled, and
+    # they overlap where the kernel releases the GIL (MATMUL_KERNEL=numpy) or there is none
+    pools = {"shm": SharedPool, "resident": ResidentPool, "threads": ThreadPool}
+    with pools.get(backend, lambda cores: Pool(processes=cores))(cores) as pool:
         for i in range(testcases):
             n, b, mat = read_input(i)
             
             print(f"Teste {i+1:02d} | N={n} B={b} |", end=" ")
             
             start_time = perf_counter()
-            ans = mat_exp(mat, b, pool)
+            if backend == "shm":
+                ans = mat_exp_shm(mat, b, pool)
+            elif backend == "resident":
+                ans = mat_exp_resident(mat, b, pool)
+            elif backend == "strassen":
+                ans = mat_exp_strassen(mat, b, pool)
+            else:
+                ans = mat_exp(mat, b, pool)
             end_time = perf_counter()
             duration = end_time - start_time
             durations.append(duration)
+            if phase_log is not None:
+                phase_rows.extend([i, it] + [record[phase] for phase in parallel_phases] + [record["bytes"]]
+                                  for it, record in enumerate(phase_log))
+                phase_log.clear()
             
             print(f"{duration:.4f}s")
 
-    write_output(f"paralelo{cores}", durations)
+    suffix = f"_{backend}" if backend != "pool" else ""
+    write_output(f"paralelo{suffix}{cores}", durations)
+    if phase_rows:
+        write_rows(f"paralelo{suffix}{cores}_phases", ["test", "iteration"] + parallel_phases + ["bytes"], phase_rows)
     print(f"--- END ---")
\ No newline at end of file
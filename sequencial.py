@@ -1,34 +1,46 @@
 from time import perf_counter
-from typing import List
-from copy import deepcopy
+from typing import List, Optional
 
+import shared
 from shared import *
 
-def mat_mul(a: List[List[int]], b: List[List[int]]) -> List[List]:
+def mat_mul(a: Matrix, b: Matrix, out: Optional[Matrix] = None) -> Matrix:
+    if shared.kernel == "numpy":
+        import vetorizado
+        return vetorizado.mat_mul(a, b)
+    return mat_mul_packed(operand(a), pack_rows(operand(b)), len(b), out=out)
+
+def mat_exp(a: Matrix, b: int) -> Matrix:
     n = len(a)
-    c = [[0]*n for _ in range(n)]
-    for i in range(n): 
-        for j in range(n):
-            for k in range(n):
-                c[i][j] += a[i][k] * b[k][j]
-            c[i][j] %= mod
-    return c
+    base = as_matrix(a).reduced()
+    if shared.kernel == "numpy":
+        return run_plan(exp_plan(b), base, verified(serial(mat_mul)), lambda: mat_identity(n))
+
+    # right is packed once per batch, and registers released by the plan become
+    # the output buffers of later products
+    free = []
+    def mul_many(lefts, right):
+        packed = pack_rows(right)
+        return [mat_mul_packed(left, packed, n, out=free.pop() if free else None) for left in lefts]
+    return run_plan(exp_plan(b), base, verified(mul_many), lambda: mat_identity(n), free.append)
 
-def mat_exp(a: List[List], b: int):
-    ans = mat_identity(len(a))
-    base = deepcopy(a)
-    while b:
-        if b & 1:
-            ans = mat_mul(ans, base)
-        base = mat_mul(base, base)
-        b //= 2
-    return ans
+def mat_exp_many(a: Matrix, exponents: List[int], cache: Optional[MatrixPowerCache] = power_cache) -> List[Matrix]:
+    # [A^b for b in exponents] over one chain of squarings, kept in cache for later calls
+    n = len(a)
+    base = as_matrix(a).reduced()
+    if shared.kernel == "numpy":
+        return run_many(base, exponents, verified(serial(mat_mul)), lambda: mat_identity(n), cache)
+    def mul_many(lefts, right):
+        packed = pack_rows(right)
+        return [mat_mul_packed(left, packed, n) for left in lefts]
+    return run_many(base, exponents, verified(mul_many), lambda: mat_identity(n), cache)
 
 if __name__ == "__main__":
     durations = []
     for i in range(testcases):
         n, b, mat = read_input(i)
-        print(f"Test {i+1:02d} | N={n} B={b} |", end=" ")
+        saved = binary_products(b) - len(exp_plan(b).steps)
+        print(f"Test {i+1:02d} | N={n} B={b} | {saved} products saved |", end=" ")
         
         start_time = perf_counter()
         ans = mat_exp(mat, b)
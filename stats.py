@@ -1,62 +1,10 @@
 # ai generated code
 
-import matplotlib.pyplot as plt
-import pandas as pd
-import seaborn as sns
 import numpy as np
 import os
-from shared import read_input, testcases, output_folder
-
-# Configuração Visual
-sns.set_theme(style="whitegrid")
-
-# Mapeamento dos Arquivos
-FILES_MAP = {
-    "Sequencial": "sequencial.csv",
-    "Paralelo (2 Cores)": "paralelo2.csv",
-    "Paralelo (4 Cores)": "paralelo4.csv",
-    "Paralelo (8 Cores)": "paralelo8.csv",
-    "Distribuido (2 Nós)": "distribuido2.csv",
-    "Distribuido (4 Nós)": "distribuido4.csv",
-    "Distribuido (8 Nós)": "distribuido8.csv"
-}
-
-def carregar_dados():
-    # 1. Mapear Teste ID -> Tamanho N
-    map_id_to_n = []
-    for i in range(testcases):
-        try:
-            n, _, _ = read_input(i)
-            map_id_to_n.append(n)
-        except:
-            break
-            
-    data_frames = []
-    
-    for label, filename in FILES_MAP.items():
-        path = os.path.join(output_folder, filename)
-        if not os.path.exists(path):
-            print(f"[AVISO] {filename} não encontrado. Ignorando.")
-            continue
-            
-        df = pd.read_csv(path)
-        limit = min(len(df), len(map_id_to_n))
-        df = df.iloc[:limit]
-        df['N'] = map_id_to_n[:limit]
-        df['Algoritmo'] = label.split()[0] 
-        
-        if "Sequencial" in label:
-            df['Cores'] = 1
-        else:
-            import re
-            nums = re.findall(r'\d+', label)
-            df['Cores'] = int(nums[0]) if nums else 1
-            
-        df['NomeCompleto'] = label
-        data_frames.append(df)
-    
-    if not data_frames: return None
-    return pd.concat(data_frames)
+import pandas as pd
+from analise import (carregar_dados, carregar_fases, resumir_fases, arquivos_fases, arquivos_testes,
+                     entradas, precisa_gerar, marcar_gerado, graficos)
 
 def calcular_metricas(df):
     # Agrupa por NomeCompleto e N -> Média de Tempo
@@ -78,7 +26,10 @@ def calcular_metricas(df):
 def plot_eficiencia(df, algoritmo, filename):
     subset = df[df['Algoritmo'] == algoritmo]
     if subset.empty: return
+    arquivos = entradas(subset, __file__)
+    if not precisa_gerar(f"graficos/{filename}", arquivos): return
 
+    plt, sns = graficos()
     plt.figure(figsize=(10, 6))
     
     # Plota a Eficiência
@@ -99,12 +50,16 @@ def plot_eficiencia(df, algoritmo, filename):
     
     plt.savefig(f"graficos/{filename}")
     plt.close()
+    marcar_gerado(f"graficos/{filename}", arquivos)
     print(f"Gerado: graficos/{filename}")
 
 def plot_escalabilidade(df, algoritmo, filename):
     subset = df[df['Algoritmo'] == algoritmo]
     if subset.empty: return
+    arquivos = entradas(subset, __file__)
+    if not precisa_gerar(f"graficos/{filename}", arquivos): return
 
+    plt, sns = graficos()
     plt.figure(figsize=(10, 6))
     
     sns.lineplot(data=subset, x='N', y='Speedup', hue='Cores', palette="viridis", marker="o", linewidth=2.5)
@@ -117,6 +72,7 @@ def plot_escalabilidade(df, algoritmo, filename):
     
     plt.savefig(f"graficos/{filename}")
     plt.close()
+    marcar_gerado(f"graficos/{filename}", arquivos)
     print(f"Gerado: graficos/{filename}")
 
 def plot_comparacao_barras(df, log_scale=False, log_base=10):
@@ -125,7 +81,12 @@ def plot_comparacao_barras(df, log_scale=False, log_base=10):
     log_base: pode ser 10, 2 ou np.e
     """
     subset = df[(df['Cores'] == 1) | (df['Cores'] == 8)].copy()
+    base_name = "e" if log_base == np.e else str(log_base)
+    nome_arq = f"comparacao_global_log{base_name}.png" if log_scale else "comparacao_global_linear.png"
+    arquivos = entradas(subset, __file__)
+    if not precisa_gerar(f"graficos/{nome_arq}", arquivos): return
     
+    plt, sns = graficos()
     plt.figure(figsize=(12, 6))
     
     ax = sns.barplot(data=subset, x='N', y='duration', hue='Algoritmo', palette="muted")
@@ -147,21 +108,17 @@ def plot_comparacao_barras(df, log_scale=False, log_base=10):
         # AQUI ESTÁ O TRUQUE:
         plt.yscale("log", base=log_base)
         
-        # Ajuste o nome do arquivo para não sobrescrever
-        base_name = "e" if log_base == np.e else str(log_base)
-        nome_arq = f"comparacao_global_log{base_name}.png"
-        
         # Opcional: Ajustar o formatador do eixo Y para não ficar em notação científica estranha
         from matplotlib.ticker import ScalarFormatter
         ax.yaxis.set_major_formatter(ScalarFormatter())
     else:
         for container in ax.containers:
             ax.bar_label(container, fmt='%.2f', padding=3, rotation=90, fontsize=9)
-        nome_arq = "comparacao_global_linear.png"
         plt.ylim(0, subset['duration'].max() * 1.15) 
     
     plt.savefig(f"graficos/{nome_arq}")
     plt.close()
+    marcar_gerado(f"graficos/{nome_arq}", arquivos)
     print(f"Gerado: graficos/{nome_arq}")
 
 def plot_detalhe_por_n(df):
@@ -181,7 +138,11 @@ def plot_detalhe_por_n(df):
 
     for n in tamanhos:
         subset = df_filtered[df_filtered['N'] == n]
+        filename = f"graficos/comparacao_N_{n}.png"
+        arquivos = entradas(subset, __file__)
+        if not precisa_gerar(filename, arquivos): continue
         
+        plt, sns = graficos()
         plt.figure(figsize=(8, 6))
         
         # Plot
@@ -206,15 +167,18 @@ def plot_detalhe_por_n(df):
         plt.ylim(0, subset['duration'].max() * 1.15)
         
         # Salva
-        filename = f"graficos/comparacao_N_{n}.png"
         plt.savefig(filename)
         plt.close()
+        marcar_gerado(filename, arquivos)
         print(f" -> Salvo: {filename}")
 
 def plot_overhead(df, algoritmo, filename):
     subset = df[(df['Algoritmo'] == algoritmo) & (df['Cores'] > 1)]
     if subset.empty: return
+    arquivos = entradas(subset, __file__)
+    if not precisa_gerar(f"graficos/{filename}", arquivos): return
 
+    plt, sns = graficos()
     plt.figure(figsize=(10, 6))
     
     sns.lineplot(data=subset, x='N', y='Overhead_User', hue='Cores', palette="Reds", marker="X", linewidth=2.5)
@@ -228,6 +192,7 @@ def plot_overhead(df, algoritmo, filename):
     
     plt.savefig(f"graficos/{filename}")
     plt.close()
+    marcar_gerado(f"graficos/{filename}", arquivos)
     print(f"Gerado: graficos/{filename}")
 
 def main():
@@ -239,8 +204,20 @@ def main():
     stats_df = calcular_metricas(raw_df)
     
     # Salva tabela arredondada
-    stats_df.to_csv("tabela_completa.csv", index=False)
-    print("Tabela salva em 'tabela_completa.csv'")
+    arquivos = entradas(raw_df, __file__)
+    if precisa_gerar("tabela_completa.csv", arquivos):
+        stats_df.to_csv("tabela_completa.csv", index=False)
+        marcar_gerado("tabela_completa.csv", arquivos)
+        print("Tabela salva em 'tabela_completa.csv'")
+
+    # Tempo por fase e bytes transferidos, a partir de output/*_phases.csv
+    fases_df = carregar_fases()
+    arquivos = arquivos_fases() + arquivos_testes() + [__file__]
+    if fases_df is not None and precisa_gerar("tabela_fases.csv", arquivos):
+        resumo, _ = resumir_fases(fases_df)
+        resumo.round(6).to_csv("tabela_fases.csv", index=False)
+        marcar_gerado("tabela_fases.csv", arquivos)
+        print("Tabela salva em 'tabela_fases.csv'")
 
     plot_detalhe_por_n(stats_df)
     
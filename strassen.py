@@ -0,0 +1,108 @@
+from time import perf_counter
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from shared import *
+from vetorizado import mod_matmul, to_array, to_matrix
+
+# below this size the base kernel is faster than another level of recursion;
+# calibrate_cutoff() measures it for the current machine and engine
+cutoff = 512
+calibrated = False
+
+def split(m: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    h = m.shape[0] // 2
+    return m[:h, :h], m[:h, h:], m[h:, :h], m[h:, h:]
+
+def pad_even(m: np.ndarray) -> np.ndarray:
+    # odd sizes get one zero row and column, peeled off again after the product
+    n = m.shape[0]
+    if n % 2 == 0:
+        return m
+    padded = np.zeros((n + 1, n + 1), dtype=np.int64)
+    padded[:n, :n] = m
+    return padded
+
+def subproducts(a: np.ndarray, b: np.ndarray, mod_val: int = mod) -> List[Tuple[np.ndarray, np.ndarray]]:
+    # Winograd's form: the 7 independent products of one level, 8 additions before them
+    a11, a12, a21, a22 = split(pad_even(a))
+    b11, b12, b21, b22 = split(pad_even(b))
+    s1 = (a21 + a22) % mod_val
+    s2 = (s1 - a11) % mod_val
+    s3 = (a11 - a21) % mod_val
+    s4 = (a12 - s2) % mod_val
+    t1 = (b12 - b11) % mod_val
+    t2 = (b22 - t1) % mod_val
+    t3 = (b22 - b12) % mod_val
+    t4 = (t2 - b21) % mod_val
+    return [(a11, b11), (a12, b21), (s4, b22), (a22, t4), (s1, t1), (s2, t2), (s3, t3)]
+
+def combine(products: List[np.ndarray], n: int, mod_val: int = mod) -> np.ndarray:
+    # the 7 remaining additions, then the padding row/column is dropped
+    m1, m2, m3, m4, m5, m6, m7 = products
+    u2 = (m1 + m6) % mod_val
+    u3 = (u2 + m7) % mod_val
+    u4 = (u2 + m5) % mod_val
+    h = m1.shape[0]
+    c = np.empty((2 * h, 2 * h), dtype=np.int64)
+    c[:h, :h] = (m1 + m2) % mod_val
+    c[:h, h:] = (u4 + m3) % mod_val
+    c[h:, :h] = (u3 - m4) % mod_val
+    c[h:, h:] = (u3 + m5) % mod_val
+    return c[:n, :n]
+
+def strassen(a: np.ndarray, b: np.ndarray, mod_val: int = mod, base: Optional[int] = None) -> np.ndarray:
+    base = cutoff if base is None else base
+    n = a.shape[0]
+    if n <= max(base, 1):
+        return mod_matmul(a, b, mod_val)
+    products = [strassen(x, y, mod_val, base) for x, y in subproducts(a, b, mod_val)]
+    return combine(products, n, mod_val)
+
+def strassen_task(a: np.ndarray, b: np.ndarray, mod_val: int, base: int) -> np.ndarray:
+    return strassen(a, b, mod_val, base)
+
+def wrong_subproducts(pairs: List[Tuple[np.ndarray, np.ndarray]], products: List[np.ndarray],
+                      mod_val: int = mod) -> List[int]:
+    # which of the 7 products of one level fail the Freivalds check, to name the worker
+    # or rank behind a whole product that failed it
+    return [i for i, ((x, y), m) in enumerate(zip(pairs, products)) if verify_product(x, y, m, mod_val=mod_val)]
+
+def calibrate_cutoff(sizes: Tuple[int, ...] = (128, 256, 512, 1024), mod_val: int = mod) -> int:
+    # smallest size at which one level of recursion beats the base kernel; when none
+    # of the sizes does, recursion is left for matrices beyond twice the largest one
+    global cutoff, calibrated
+    calibrated = True
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        a = rng.integers(0, mod_val, (n, n))
+        start = perf_counter()
+        mod_matmul(a, a, mod_val)
+        direct = perf_counter() - start
+        start = perf_counter()
+        strassen(a, a, mod_val, n - 1)
+        recursive = perf_counter() - start
+        if recursive < direct:
+            cutoff = n // 2
+            return cutoff
+    cutoff = 2 * sizes[-1]
+    return cutoff
+
+def ensure_cutoff() -> int:
+    # entry points call this before timing anything, the measurement runs once per process
+    return cutoff if calibrated else calibrate_cutoff()
+
+def mat_exp_array(a: np.ndarray, b: int, mod_val: int = mod) -> np.ndarray:
+    mul_many = lambda lefts, right: [strassen(left, right, mod_val) for left in lefts]
+    return run_plan(exp_plan(b), a, verified(mul_many, mod_val), lambda: np.eye(a.shape[0], dtype=np.int64))
+
+def mat_mul(a: Matrix, b: Matrix) -> Matrix:
+    return to_matrix(strassen(to_array(a), to_array(b)))
+
+def mat_exp(a: Matrix, b: int) -> Matrix:
+    return to_matrix(mat_exp_array(to_array(a), b))
+
+if __name__ == "__main__":
+    import benchmark
+    benchmark.main(["--backend", "strassen"] + sys.argv[1:])
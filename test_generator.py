@@ -1,6 +1,10 @@
+import os
+import sys
 from random import randint
 from typing import List
 
+from shared import test_folder, testcases, test_path, read_input, write_binary
+
 sizes = [16, 32, 64, 128, 256]
 test_set_size = 10
 max_b = 50738
@@ -10,7 +14,22 @@ def rand_mat(n: int) -> List[List[int]]:
     ans = [[randint(-max_v, max_v) for _ in range(n)] for _ in range(n)]
     return ans
 
+def convert_tests():
+    # tests/<i>.txt -> tests/<i>.bin, read_input prefers the binary file while it is the newer one
+    for i in range(testcases):
+        try:
+            n, b, mat = read_input(i)
+        except FileNotFoundError:
+            break
+        write_binary(test_path(i, "bin"), n, b, mat)
+        print(f"converted {test_path(i)}")
+
 if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "text"
+    if mode == "convert":
+        convert_tests()
+        sys.exit()
+
     index = 0
     for n in sizes:
         for _ in range(test_set_size):
@@ -18,10 +37,16 @@ if __name__ == "__main__":
             print(f"test {index}: {n} {b}")
             mat = rand_mat(n)
             index += 1
-            with open(f"tests/{index}.txt", "w") as f:
-                f.write(f"{n} {b}\n")
-                for line in mat:
-                    f.write(" ".join([str(x) for x in line])+"\n")
+            if mode == "binary":
+                write_binary(f"{test_folder}/{index}.bin", n, b, mat)
+            else:
+                with open(f"{test_folder}/{index}.txt", "w") as f:
+                    f.write(f"{n} {b}\n")
+                    for line in mat:
+                        f.write(" ".join([str(x) for x in line])+"\n")
+                # a binary from an earlier convert holds the old matrix
+                if os.path.exists(f"{test_folder}/{index}.bin"):
+                    os.remove(f"{test_folder}/{index}.bin")
             
             print(f"created")
 
@@ -0,0 +1,139 @@
+from functools import lru_cache
+from math import isqrt
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from shared import *
+
+int64_bits = 63
+float_bits = 53
+
+# "rns" runs the product as float64 BLAS matmuls modulo small primes,
+# "limbs" as int64 matmuls (numpy does not use BLAS for integers)
+engine = "rns"
+
+def limb_layout(mod_val: int, n: int):
+    # split b into limbs of `width` bits so that every partial product a[i][k] * limb
+    # fits in int64, and accumulate at most `block` of them before reducing
+    bits = (mod_val - 1).bit_length()
+    if bits > int64_bits - 2:
+        raise ValueError(f"modulus {mod_val} is too large for int64 limbs")
+    width = min((bits + 1) // 2, int64_bits - 1 - bits)
+    limbs = -(-bits // width)
+    bound = max(1, (mod_val - 1) * ((1 << width) - 1))
+    block = max(1, min(n, ((1 << int64_bits) - 1) // bound))
+    return width, limbs, block
+
+def to_array(a, mod_val: int = mod) -> np.ndarray:
+    return np.mod(np.asarray(a, dtype=np.int64), mod_val)
+
+def mod_matmul_limbs(a: np.ndarray, b: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    # a and b must already be reduced to [0, mod_val)
+    inner = a.shape[1]
+    width, limbs, block = limb_layout(mod_val, inner)
+    mask = (1 << width) - 1
+
+    c = np.zeros((a.shape[0], b.shape[1]), dtype=np.int64)
+    for t in reversed(range(limbs)):
+        limb = (b >> (width * t)) & mask
+        partial = np.zeros_like(c)
+        for k in range(0, inner, block):
+            partial += (a[:, k:k + block] @ limb[k:k + block]) % mod_val
+            partial %= mod_val
+        # horner step: c = c * 2^width + partial, never leaves int64
+        c <<= width
+        c += partial
+        c %= mod_val
+    return c
+
+@lru_cache(maxsize=None)
+def rns_basis(n: int, mod_val: int) -> Tuple[Tuple[int, ...], Tuple[Tuple[int, ...], ...], Tuple[int, ...]]:
+    # primes p with n * (p-1)^2 <= 2^53, so every float64 dot product mod p is exact,
+    # taken until their product covers the largest integer dot product n * (mod-1)^2
+    limit = isqrt(((1 << float_bits) - 1) // max(n, 1)) + 1
+    need = max(n, 1) * (mod_val - 1) ** 2
+    primes = []
+    product = 1
+    p = limit
+    while product <= need:
+        while not is_prime(p):
+            p -= 1
+        primes.append(p)
+        product *= p
+        p -= 1
+    # garner: inverse of p_j modulo p_i, and prod(p_j, j < i) modulo mod_val
+    inverses = tuple(tuple(pow(primes[j], -1, primes[i]) for j in range(i)) for i in range(len(primes)))
+    weights = []
+    weight = 1
+    for p in primes:
+        weights.append(weight % mod_val)
+        weight *= p
+    return tuple(primes), inverses, tuple(weights)
+
+def rns_right(b: np.ndarray, mod_val: int = mod) -> List[np.ndarray]:
+    # the half of mod_matmul_rns that only depends on b: b modulo every prime, as float64
+    primes = rns_basis(b.shape[0], mod_val)[0]
+    return [(b % p).astype(np.float64) for p in primes]
+
+def mod_matmul_rns(a: np.ndarray, b: np.ndarray, mod_val: int = mod, right: Optional[List[np.ndarray]] = None) -> np.ndarray:
+    # a and b must already be reduced to [0, mod_val); right is rns_right(b) when it
+    # was computed once for several row blocks of a
+    primes, inverses, weights = rns_basis(a.shape[1], mod_val)
+    right = rns_right(b, mod_val) if right is None else right
+    residues = []
+    for p, b_p in zip(primes, right):
+        c = (a % p).astype(np.float64) @ b_p
+        # the float result is an exact integer below 2^53, int64 % is far cheaper than fmod
+        residues.append(c.astype(np.int64) % p)
+
+    # mixed radix digits, each below its prime
+    digits = []
+    for i, p in enumerate(primes):
+        v = residues[i]
+        for j, inv in enumerate(inverses[i]):
+            v = (v - digits[j]) * inv % p
+        digits.append(v)
+
+    # sum digit_i * prod(p_j, j < i) mod mod_val, reduced once at the end when the
+    # whole sum fits in int64, with python ints when it does not
+    if len(primes) * max(primes) * mod_val < 1 << int64_bits:
+        c = sum(digit * weight for digit, weight in zip(digits, weights))
+        return c % mod_val
+    c = sum(digit.astype(object) * weight for digit, weight in zip(digits, weights))
+    return (c % mod_val).astype(np.int64)
+
+engines = {"limbs": mod_matmul_limbs, "rns": mod_matmul_rns}
+
+def mod_matmul(a: np.ndarray, b: np.ndarray, mod_val: int = mod) -> np.ndarray:
+    return engines[engine](a, b, mod_val)
+
+def prepare_right(b, mod_val: int = mod) -> Tuple[np.ndarray, Optional[List[np.ndarray]]]:
+    # b reduced, plus the engine's b side work, for many row blocks multiplied by one b
+    b = to_array(b, mod_val)
+    return b, rns_right(b, mod_val) if engine == "rns" else None
+
+def mod_matmul_prepared(a: np.ndarray, right: Tuple[np.ndarray, Optional[List[np.ndarray]]], mod_val: int = mod) -> np.ndarray:
+    b, residues = right
+    if residues is None:
+        return mod_matmul(a, b, mod_val)
+    return mod_matmul_rns(a, b, mod_val, residues)
+
+def mat_exp_array(a: np.ndarray, b: int, mod_val: int = mod) -> np.ndarray:
+    mul_many = lambda lefts, right: [mod_matmul(left, right, mod_val) for left in lefts]
+    return run_plan(exp_plan(b), a, verified(mul_many, mod_val), lambda: np.eye(a.shape[0], dtype=np.int64))
+
+def to_matrix(c: np.ndarray) -> Matrix:
+    # wraps the result buffer, no copy
+    return Matrix(c.shape[0], c.shape[1], np.ascontiguousarray(c))
+
+def mat_mul(a: Matrix, b: Matrix) -> Matrix:
+    # rows of a may be a slice, b is always n x n
+    return to_matrix(mod_matmul(to_array(a).reshape(len(a), len(b)), to_array(b)))
+
+def mat_exp(a: Matrix, b: int) -> Matrix:
+    return to_matrix(mat_exp_array(to_array(a), b))
+
+if __name__ == "__main__":
+    import benchmark
+    benchmark.main(["--backend", "vetorizado"] + sys.argv[1:])